@@ -1,137 +1,594 @@
-from flask import Flask, render_template, request, redirect, url_for
-from books import all_books
+import os
+import threading
+
+from flask import Flask, render_template, stream_template, request, redirect, url_for, jsonify
+from catalog import CatalogIndex, decode_cursor, encode_cursor
+from circulation import CirculationEngine, CirculationError, LogUnavailable, UnknownBook
+from facets import FacetIndex
+from metrics import SamplingProfiler, install as install_metrics, phase, registry as metrics_registry
+from page_cache import PageCache
+from records import Book, DescriptionStore
+from repository import MemoryRepository, SnapshotRepository, SQLiteRepository
+from search import SearchIndex, tokenize
+from snapshot import Snapshot
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['BOOKS_PER_PAGE'] = 50
+app.config['MAX_BOOKS_PER_PAGE'] = 500
+app.config['PAGE_CACHE_BYTES'] = 64 * 1024 * 1024
+app.config['DESCRIPTION_STORE_PATH'] = os.environ.get('DESCRIPTION_STORE_PATH')
+# Binary snapshot built with `python snapshot.py build books.py catalog.snap`
+app.config['CATALOG_SNAPSHOT'] = os.environ.get('CATALOG_SNAPSHOT')
+app.config['CATALOG_SNAPSHOT_VERIFY'] = os.environ.get('CATALOG_SNAPSHOT_VERIFY') == '1'
+# 'memory' serves books.py from RAM (or the snapshot from its memory map); 'sqlite' serves CATALOG_DATABASE,
+# filled with `python repository.py import books.py catalog.db`
+app.config['CATALOG_BACKEND'] = os.environ.get('CATALOG_BACKEND', 'memory')
+app.config['CATALOG_DATABASE'] = os.environ.get('CATALOG_DATABASE', 'catalog.db')
+# How often (seconds) to look for books written to the database by other processes
+app.config['CATALOG_RELOAD_SECONDS'] = float(os.environ.get('CATALOG_RELOAD_SECONDS', 5))
+# Write-ahead log for checkouts, returns and holds (kept in memory only if unset)
+app.config['CIRCULATION_LOG'] = os.environ.get('CIRCULATION_LOG')
+# Requests slower than this many seconds get their sampled stacks appended to
+# PROFILE_OUTPUT in collapsed (flamegraph) format; unset disables the profiler
+app.config['PROFILE_SLOW_REQUESTS'] = float(os.environ.get('PROFILE_SLOW_REQUESTS') or 0) or None
+app.config['PROFILE_OUTPUT'] = os.environ.get('PROFILE_OUTPUT', 'slow-requests.folded')
 
-def process_book_data(book, index):
+def process_book_data(book, index, descriptions=None):
     """Convert teacher's book format to our expected format"""
     # Handle multiple authors
-    author_str = ", ".join(book['authors']) if isinstance(book['authors'], list) else book['authors']
+    authors = book['authors'] if isinstance(book['authors'], list) else [book['authors']]
     
     # Handle genres (use first genre as primary category display)
-    genres_str = ", ".join(book['genres']) if isinstance(book['genres'], list) else book['genres']
+    genres = book['genres'] if isinstance(book['genres'], list) else [book['genres']]
     
-    # Handle description (join list into single string)
-    description_str = " ".join(book['description']) if isinstance(book['description'], list) else book['description']
+    # Description text goes to the shared store; the record only keeps a handle
+    if descriptions is None:
+        descriptions = DescriptionStore()
     
     # Create processed book object
-    processed_book = {
-        'id': str(index + 1),  # Generate ID from index
-        'title': book['title'],
-        'author': author_str,
-        'category': book['category'],
-        'genres': genres_str,  # Store full genres string
-        'pages': book['pages'],
-        'copies': book['copies'],
-        'available': book['available'],
-        'cover_image': book['url'],  # Map 'url' to 'cover_image'
-        'description': description_str,
-        'description_list': book['description'],  # Keep original list for paragraph extraction
-        'formatted_description': format_full_description(book['description'])  # For details page
-    }
+    processed_book = Book(
+        id=str(index + 1),  # Generate ID from index
+        title=book['title'],
+        author_list=authors,
+        category=book['category'],
+        genre_list=genres,
+        pages=book['pages'],
+        copies=book['copies'],
+        available=book['available'],
+        cover_image=book['url'],  # Map 'url' to 'cover_image'
+        descriptions=descriptions,
+        description=descriptions.add(book['description'])
+    )
     
     return processed_book
 
+def get_all_books():
+    """The raw catalog from books.py, imported on first use"""
+    if app.config['CATALOG_SNAPSHOT']:
+        raise RuntimeError("the catalog is served from a read-only snapshot; rebuild the snapshot instead")
+    if app.config['CATALOG_BACKEND'] == 'sqlite':
+        raise RuntimeError("the catalog is served from SQLite; import into the database instead")
+    
+    from books import all_books
+    return all_books
+
+def load_catalog_records():
+    """Process every book in the catalog (used to build the catalog index)"""
+    all_books = get_all_books()
+    descriptions = DescriptionStore()
+    records = [process_book_data(book, index, descriptions) for index, book in enumerate(all_books)]
+    
+    # Optionally move the description text out of the heap into a shared memory map
+    if app.config['DESCRIPTION_STORE_PATH']:
+        descriptions.spill(app.config['DESCRIPTION_STORE_PATH'])
+    
+    # Live copy counts come from the circulation engine, not the catalog source
+    circulation.seed(records)
+    sync_availability(records)
+    return records
+
+def live_available(book_id):
+    """Copy count from the circulation engine; None for books it is not tracking yet"""
+    try:
+        return circulation.available(book_id)
+    except UnknownBook:
+        return None
+
+def sync_availability(records):
+    """Copy the circulation engine's available counts onto catalog records"""
+    for book in records:
+        book.available = circulation.available(book['id'])
+
+# Page cache tags: pages showing a book's copy counts, and pages that depend on
+# which books are available (the facet filter and its counts)
+def book_tag(book_id):
+    return ('book', book_id)
+
+AVAILABILITY_FACET_TAG = ('facet', 'available')
+
+# Each update reads the live count and applies it in one step, so whichever
+# runs last leaves the facet matching the latest count
+availability_lock = threading.Lock()
+
+def availability_changed(book_id):
+    """Called by the circulation engine whenever a book's counts change"""
+    with availability_lock:
+        available = circulation.available(book_id)
+        repository.set_available(book_id, available)
+        # A facet index built later reads the new count itself, so none is built here
+        facets = facet_index
+        flipped = facets is not None and book_id in facets \
+            and facets.has('available', 'available', book_id) != (available > 0)
+        if flipped:
+            facets.set_member('available', 'available', book_id, available > 0)
+    
+    # List pages only show availability through the facet, so they only go stale
+    # when a book runs out or comes back
+    if flipped:
+        page_cache.discard(book_tag(book_id), AVAILABILITY_FACET_TAG)
+    else:
+        page_cache.discard(book_tag(book_id))
+
 def get_book_by_id(book_id):
     """Find a book by its ID"""
-    try:
-        index = int(book_id) - 1  # Convert to 0-based index
-        if 0 <= index < len(all_books):
-            return process_book_data(all_books[index], index)
-    except (ValueError, IndexError):
-        pass
-    return None
+    return repository.get(book_id)
 
 def get_books_by_category(category=None):
     """Get books filtered by category and sorted alphabetically by title"""
-    processed_books = []
-    
-    # Process all books first
-    for index, book in enumerate(all_books):
-        processed_book = process_book_data(book, index)
-        processed_books.append(processed_book)
-    
-    # Sort ALL books alphabetically by title
-    processed_books.sort(key=lambda x: x['title'].lower())
-    
-    # Then filter by category if specified
-    if category and category.lower() != 'all':
-        filtered_books = [book for book in processed_books if book['category'].lower() == category.lower()]
-        return filtered_books
-    
-    return processed_books
-
-def get_first_and_last_paragraphs(description_list):
-    """Extract first and last paragraphs from description list for preview"""
-    if not description_list or len(description_list) == 0:
-        return "No description available for this book."
-    
-    # If it's a string (fallback), convert to list
-    if isinstance(description_list, str):
-        # Try to split by double newlines first, then by periods
-        paragraphs = [p.strip() for p in description_list.split('\n\n') if p.strip()]
-        if len(paragraphs) <= 1:
-            paragraphs = [p.strip() for p in description_list.split('. ') if p.strip()]
+    return repository.by_category(category)
+
+def search_fields(book):
+    """Text of a processed book that is indexed for full-text search"""
+    return {
+        'title': book['title'],
+        'author': book['author'],
+        'genres': book['genres'],
+        'description': book['description'],
+    }
+
+def build_search_index():
+    """Index every book in the catalog for search and typeahead"""
+    # In ID order, so the bulk build can skip sorting the posting lists; the
+    # SQLite backend streams the description text in the same query
+    books = repository.records(descriptions=True)
+    return SearchIndex.build((int(book['id']), search_fields(book)) for book in books)
+
+def add_book(book):
+    """Add a book (in the books.py format) to the catalog and return its new ID"""
+    if app.config['CATALOG_BACKEND'] == 'sqlite':
+        book_id = int(repository.add(book))
+        circulation.seed([{'id': str(book_id), 'copies': book['copies'], 'available': book['available']}])
     else:
-        # It's already a list of paragraphs
-        paragraphs = [p.strip() for p in description_list if p.strip()]
-    
-    if len(paragraphs) == 0:
-        return "No description available for this book."
-    elif len(paragraphs) == 1:
-        return paragraphs[0]
+        all_books = get_all_books()
+        all_books.append(book)
+        book_id = len(all_books)
+    repository.rebuild()
+    get_search_index().add(book_id, search_fields(repository.get(book_id)))
+    return str(book_id)
+
+def update_book(book_id, book):
+    """Replace an existing book (in the books.py format) and re-index it"""
+    book_id = int(book_id)
+    if app.config['CATALOG_BACKEND'] == 'sqlite':
+        repository.replace(book_id, book)
+        circulation.seed([{'id': str(book_id), 'copies': book['copies'], 'available': book['available']}])
     else:
-        # Return ONLY first and last paragraphs with spacing
-        first = paragraphs[0]
-        last = paragraphs[-1]
-        return first + "<br><br>" + last
+        get_all_books()[book_id - 1] = book
+    repository.rebuild()
+    get_search_index().update(book_id, search_fields(repository.get(book_id)))
 
-def format_full_description(description_list):
-    """Format full description with proper paragraph spacing for details page"""
-    if not description_list or len(description_list) == 0:
-        return "No description available for this book."
+# Serialises facet index builds and the swap of reloaded indexes
+index_lock = threading.Lock()
+
+# Set when another process has written to the catalog (see reload_in_background)
+catalog_changed = threading.Event()
+
+def reload_catalog():
+    """Pick up books written to the catalog by another process.
     
-    # If it's a string, return as-is
-    if isinstance(description_list, str):
-        return description_list
+    The new search and facet indexes are built while requests carry on with
+    the current ones, then swapped in together with the version bump.
+    """
+    global search_index, facet_index
+    circulation.seed(repository.records())
+    search = build_search_index()
+    facets = FacetIndex(repository.title_order())
+    with index_lock:
+        # Writes made during the build are picked up by the next reload
+        repository.rebuild(catch_up=False)
+        facets.version = repository.version
+        search_index, facet_index = search, facets
+
+def reload_in_background():
+    """Reload the catalog every time catalog_changed is set, one reload at a time"""
+    while True:
+        catalog_changed.wait()
+        catalog_changed.clear()
+        try:
+            reload_catalog()
+        except Exception:
+            app.logger.exception("reloading the catalog failed")
+
+# Set once build_indexes() has run
+indexes_ready = threading.Event()
+
+def build_indexes():
+    """Build the search and facet indexes for the catalog loaded at startup"""
+    global search_index, facet_index
+    search = build_search_index()
+    facets = FacetIndex(repository.title_order(), repository.version)
+    with index_lock:
+        search_index, facet_index = search, facets
+    indexes_ready.set()
+
+def get_search_index():
+    """The search index, once it has been built"""
+    indexes_ready.wait()
+    return search_index
+
+def get_facet_index():
+    """Facet index over the current catalog, rebuilt whenever the catalog changes"""
+    global facet_index
+    indexes_ready.wait()
+    index = facet_index
+    if index is None or index.version != repository.version:
+        # One request builds it; the others wait for that instead of building their own
+        with index_lock:
+            index = facet_index
+            version = repository.version
+            if index is None or index.version != version:
+                index = facet_index = FacetIndex(repository.title_order(), version)
+    return index
+
+def search_books(query, mask=None, after=None, limit=None, ranked=None):
+    """Return (books, count, total, next_cursor) for a ranked search, best match first"""
+    if ranked is None:
+        ranked = get_search_index().search(query)
+    facets = get_facet_index()
+    
+    matches = []
+    for book_id, score in ranked:
+        book_id = str(book_id)
+        # Only keep matches still in the catalog that also pass the facet filters
+        if book_id not in facets or (mask is not None and not facets.contains(mask, book_id)):
+            continue
+        matches.append(book_id)
+    
+    # Search cursors hold the normalised query and the last book ID shown
+    normalised = ' '.join(tokenize(query))
+    start = 0
+    if after and after[0] == normalised:
+        for position, book_id in enumerate(matches):
+            if int(book_id) == after[1]:
+                start = position + 1
+                break
     
-    # If it's a list, join with double line breaks for paragraph spacing
-    paragraphs = [p.strip() for p in description_list if p.strip()]
-    return '<br><br>'.join(paragraphs)
+    end = len(matches) if limit is None else min(start + limit, len(matches))
+    next_cursor = None
+    if end < len(matches):
+        next_cursor = encode_cursor((normalised, int(matches[end - 1])))
+    
+    # Only the books on this page are fetched from the repository, in one lookup
+    books = repository.get_many(matches[start:end])
+    return books, end - start, len(matches), next_cursor
+
+# Built once at startup; call repository.rebuild() after changing the catalog
+circulation = CirculationEngine(app.config['CIRCULATION_LOG'], on_change=availability_changed)
+if app.config['CATALOG_BACKEND'] == 'sqlite':
+    # Records stay in the database; only the search and facet indexes and the
+    # copy counts are held in memory
+    catalog = None
+    repository = SQLiteRepository(app.config['CATALOG_DATABASE'], available=live_available,
+                                  check_interval=app.config['CATALOG_RELOAD_SECONDS'])
+    circulation.seed(repository.records())
+elif app.config['CATALOG_SNAPSHOT']:
+    # A snapshot is memory-mapped, so books.py never has to be compiled and
+    # records are decoded from the mapping only when a request reads them
+    catalog = None
+    snapshot = Snapshot(app.config['CATALOG_SNAPSHOT'], verify=app.config['CATALOG_SNAPSHOT_VERIFY'])
+    repository = SnapshotRepository(snapshot, available=live_available)
+    # Copy counts are read from the mapping as books are first used, not all up front
+    circulation.seed_lazily(repository.stored_counts)
+else:
+    catalog = CatalogIndex(load_catalog_records)
+    repository = MemoryRepository(catalog)
+    catalog.rebuild()
+search_index = None
+facet_index = None
+
+# Replay the circulation log on top of the counts from the catalog source
+circulation.open()
+if catalog is not None:
+    sync_availability(catalog.all())
+
+if app.config['CATALOG_SNAPSHOT']:
+    # Start serving straight away; search and facet pages wait until their indexes are built
+    threading.Thread(target=build_indexes, name='index-builder', daemon=True).start()
+else:
+    build_indexes()
+
+# Rendered pages, dropped whenever the catalog version changes
+page_cache = PageCache(app.config['PAGE_CACHE_BYTES'])
+cached_page = page_cache.cached(version=lambda: repository.version,
+                                last_modified=lambda: repository.modified,
+                                bypass=lambda: request.args.get('stream') == '1')
+
+# Request timings, response sizes and cache counters, served on /metrics
+profiler = None
+if app.config['PROFILE_SLOW_REQUESTS']:
+    profiler = SamplingProfiler(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_OUTPUT'])
+install_metrics(app, profiler)
+metrics_registry.derived('library_page_cache_hits_total', "Rendered page cache hits.",
+                         lambda: page_cache.hits, kind='counter')
+metrics_registry.derived('library_page_cache_misses_total', "Rendered page cache misses.",
+                         lambda: page_cache.misses, kind='counter')
+metrics_registry.derived('library_page_cache_hit_ratio', "Share of page cache lookups that were hits.",
+                         lambda: page_cache.hits / ((page_cache.hits + page_cache.misses) or 1))
+metrics_registry.derived('library_page_cache_bytes', "Bytes held by the rendered page cache.",
+                         lambda: page_cache.size)
+metrics_registry.derived('library_catalog_books', "Books in the catalog.", lambda: len(repository))
+
+if app.config['CATALOG_BACKEND'] == 'sqlite':
+    threading.Thread(target=reload_in_background, name='catalog-reloader', daemon=True).start()
+
+@app.before_request
+def reload_changed_catalog():
+    # Only one request sees each change; it hands the reload to the background thread
+    if repository.changed():
+        catalog_changed.set()
 
 # Routes
 @app.route('/')
 def home():
     return redirect(url_for('book_titles'))
 
+def get_page_size(stream=False):
+    """Read the page size from the query string, clamped to the configured maximum"""
+    limit = request.args.get('limit', '')
+    
+    # Streamed pages may run to the end of the listing since nothing is buffered
+    if stream and not limit:
+        return None
+    
+    try:
+        limit = int(limit)
+    except ValueError:
+        return app.config['BOOKS_PER_PAGE']
+    return max(1, min(limit, app.config['MAX_BOOKS_PER_PAGE']))
+
+def get_facet_filters():
+    """Read the facet selection ({field: [values]}) and AND-ed fields from the query string"""
+    category = request.args.get('category', '').lower()
+    filters = {
+        'category': [category] if category and category != 'all' else [],
+        'genre': request.args.getlist('genre'),
+        'author': request.args.getlist('author'),
+        'pages': request.args.getlist('pages'),
+        'available': ['available'] if request.args.get('available') == '1' else [],
+    }
+    
+    # Genres are OR-ed by default; genre_mode=all requires every ticked genre
+    match_all = ('genre',) if request.args.get('genre_mode') == 'all' else ()
+    return filters, match_all
+
+def find_books(limit):
+    """Run the request's search, facet and pagination arguments against the catalog"""
+    query = request.args.get('q', '').strip()
+    after = decode_cursor(request.args.get('after', ''))
+    
+    filters, match_all = get_facet_filters()
+    if filters['available']:
+        page_cache.tag(AVAILABILITY_FACET_TAG)
+    filtered = query or any(values for field, values in filters.items() if field != 'category')
+    
+    if not filtered and not indexes_ready.is_set():
+        # Plain listings need no index, so they are served while the indexes are still being built
+        category = filters['category'][0] if filters['category'] else None
+        books, count, next_cursor = repository.page(category, after=after, limit=limit)
+        return dict(books=books, count=count, total=repository.count(category), next_cursor=next_cursor,
+                    limit=limit, facets=None, filters=filters, match_all=match_all, within=None)
+    
+    facets = get_facet_index()
+    # Search matches become one more bitset the facets are intersected with
+    ranked = get_search_index().search(query) if query else None
+    within = facets.mask_of(str(book_id) for book_id, score in ranked) if query else None
+    mask = facets.select(filters, match_all, within)
+    
+    if query:
+        books, count, total, next_cursor = search_books(query, mask, after=after, limit=limit, ranked=ranked)
+    elif not filtered:
+        # Plain and category listings are keyset range scans over the repository's
+        # title order: the page starts right after the cursor's sort key
+        category = filters['category'][0] if filters['category'] else None
+        books, count, next_cursor = repository.page(category, after=after, limit=limit)
+        total = len(facets.books) if mask is None else mask.bit_count()
+    else:
+        books, count, next_cursor = facets.page(mask, after=after, limit=limit)
+        total = mask.bit_count()
+    
+    return dict(books=books, count=count, total=total, next_cursor=next_cursor, limit=limit,
+                facets=facets, filters=filters, match_all=match_all, within=within)
+
 @app.route('/book-titles')
+@cached_page
 def book_titles():
-    """Display all books with optional category filtering"""
+    """Display books with optional category, facet and search filtering, one page at a time"""
     category = request.args.get('category', '').lower()
-    books = get_books_by_category(category)
+    query = request.args.get('q', '').strip()
+    stream = request.args.get('stream') == '1'
+    after = request.args.get('after', '')
+    
+    with phase('data'):
+        results = find_books(get_page_size(stream))
+        books, count, total, next_cursor = results['books'], results['count'], results['total'], results['next_cursor']
+        filters, match_all = results['filters'], results['match_all']
+        limit = results['limit']
+        
+        facets = results['facets'] or get_facet_index()
+        facet_counts = facets.counts(filters, match_all, results['within'])
+        # The counts include how many books are available now
+        page_cache.tag(AVAILABILITY_FACET_TAG)
+        
+        # Fetch the page's records and their previews here, so 'render' only times the
+        # template; a streamed listing may run to the end of the catalog, so it stays lazy
+        cards = ((book, book['description_preview']) for book in books)
+        if not stream:
+            cards = list(cards)
     
-    # Prepare books with preview descriptions
-    books_with_preview = []
-    for book in books:
-        book_copy = book.copy()
-        # Use the original description list for paragraph extraction
-        book_copy['description_preview'] = get_first_and_last_paragraphs(book.get('description_list', book['description']))
-        books_with_preview.append(book_copy)
+    context = dict(books=cards,
+                   count=count,
+                   total=total,
+                   selected_category=category,
+                   selected_query=query,
+                   filters=filters,
+                   genre_mode='all' if match_all else 'any',
+                   facet_counts=facet_counts,
+                   category_counts={value: count for value, label, count in facet_counts['category']},
+                   page_args={key: values for key, values in request.args.lists() if key != 'after'},
+                   after=after,
+                   next_cursor=next_cursor,
+                   limit=limit)
     
-    return render_template('book_titles.html', 
-                         books=books_with_preview, 
-                         selected_category=category)
+    if stream:
+        # Flush cards to the client as they are rendered; the middleware times the whole body
+        return app.response_class(stream_template('book_titles.html', **context))
+    
+    with phase('render'):
+        return render_template('book_titles.html', **context)
+
+@app.route('/api/suggest')
+def suggest():
+    """Typeahead completions for the search box"""
+    query = request.args.get('q', '')
+    return jsonify(query=query, suggestions=get_search_index().suggest(query))
+
+# Fields the JSON API can return; description fields are only sent when asked for
+API_FIELDS = {
+    'id': lambda book: book['id'],
+    'title': lambda book: book['title'],
+    'author': lambda book: book['author'],
+    'authors': lambda book: list(book['author_list']),
+    'category': lambda book: book['category'],
+    'genres': lambda book: list(book['genre_list']),
+    'pages': lambda book: book['pages'],
+    'copies': lambda book: book['copies'],
+    'available': lambda book: book['available'],
+    'cover_image': lambda book: book['cover_image'],
+    'description': lambda book: book['description_list'],
+    'description_preview': lambda book: book['description_preview'],
+    'formatted_description': lambda book: book['formatted_description'],
+}
+API_DEFAULT_FIELDS = ('id', 'title', 'author', 'authors', 'category', 'genres',
+                      'pages', 'copies', 'available', 'cover_image')
+
+def get_api_fields():
+    """Fields requested with fields=a,b,c (in API_FIELDS order); None if any are unknown"""
+    requested = request.args.get('fields', '')
+    if not requested:
+        return API_DEFAULT_FIELDS
+    
+    requested = {field.strip() for field in requested.split(',') if field.strip()}
+    if not requested <= API_FIELDS.keys():
+        return None
+    return tuple(field for field in API_FIELDS if field in requested)
+
+def book_payload(book, fields):
+    """Project a book onto the requested API fields"""
+    if 'available' in fields or 'copies' in fields:
+        page_cache.tag(book_tag(book['id']))
+    return {field: API_FIELDS[field](book) for field in fields}
+
+@app.route('/api/books')
+@cached_page
+def api_books():
+    """List books as JSON; supports the /book-titles filters, fields= and ids=1,2,3"""
+    fields = get_api_fields()
+    if fields is None:
+        return jsonify(error="unknown field", fields=sorted(API_FIELDS)), 400
+    
+    # Bulk fetch: several books in one round trip, in the order asked for
+    if request.args.get('ids'):
+        book_ids = [book_id.strip() for book_id in request.args['ids'].split(',') if book_id.strip()]
+        if len(book_ids) > app.config['MAX_BOOKS_PER_PAGE']:
+            return jsonify(error=f"at most {app.config['MAX_BOOKS_PER_PAGE']} ids per request"), 400
+        
+        books, missing = [], []
+        for book_id, book in zip(book_ids, repository.get_many(book_ids)):
+            if book is None:
+                missing.append(book_id)
+            else:
+                books.append(book_payload(book, fields))
+        return jsonify(books=books, missing=missing)
+    
+    with phase('data'):
+        results = find_books(get_page_size())
+        # Projecting reads the records (and any description text) for the page
+        books = [book_payload(book, fields) for book in results['books']]
+    with phase('serialize'):
+        return jsonify(books=books,
+                       count=results['count'],
+                       total=results['total'],
+                       next=results['next_cursor'])
+
+@app.route('/api/books/<book_id>')
+@cached_page
+def api_book(book_id):
+    """A single book as JSON"""
+    fields = get_api_fields()
+    if fields is None:
+        return jsonify(error="unknown field", fields=sorted(API_FIELDS)), 400
+    
+    book = get_book_by_id(book_id)
+    if book is None:
+        return jsonify(error=f"no book with ID {book_id}"), 404
+    return jsonify(book_payload(book, fields))
+
+CIRCULATION_ACTIONS = {
+    'checkout': circulation.checkout,
+    'return': circulation.return_copy,
+    'hold': circulation.place_hold,
+}
+
+@app.route('/api/books/<book_id>/<action>', methods=['POST'])
+def circulate(book_id, action):
+    """Check out, return or place a hold on a book"""
+    if action not in CIRCULATION_ACTIONS:
+        return jsonify(error=f"unknown action {action!r}"), 404
+    
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = request.form
+    elif not isinstance(payload, dict):
+        return jsonify(error="expected a JSON object"), 400
+    patron = payload.get('patron') or None
+    
+    try:
+        book_id = str(int(book_id))
+        CIRCULATION_ACTIONS[action](book_id, patron)
+    except (ValueError, UnknownBook):
+        return jsonify(error=f"no book with ID {book_id}"), 404
+    except LogUnavailable as error:
+        return jsonify(error=str(error)), 503
+    except CirculationError as error:
+        return jsonify(error=str(error), **circulation.status(book_id)), 409
+    
+    return jsonify(circulation.status(book_id))
 
 @app.route('/book-details/<book_id>')
+@cached_page
 def book_details(book_id):
     """Display detailed information about a specific book"""
-    book = get_book_by_id(book_id)
+    with phase('data'):
+        book = get_book_by_id(book_id)
+        description = book['formatted_description'] if book else None
     
     if not book:
         return redirect(url_for('book_titles'))
+    page_cache.tag(book_tag(book['id']))
     
-    return render_template('book_details.html', book=book)
+    with phase('render'):
+        return render_template('book_details.html', book=book, description=description)
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -0,0 +1,140 @@
+"""Deterministic synthetic catalogs for benchmarking.
+
+Books are generated in the books.py dict format with category, genre,
+page-count and description shapes modelled on the hand-written catalog.
+The same --books/--seed always produce the same catalog:
+
+    python -m bench.generate --books 200000 -o /tmp/books-200k.snap
+    python -m bench.generate --books 1000 -o /tmp/books-1k.jsonl
+"""
+import argparse
+import json
+import os
+import random
+from itertools import accumulate
+
+# (category, weight, page range) -- Adult books are the bulk and the longest
+CATEGORIES = (
+    ('Adult', 5, (150, 900)),
+    ('Teens', 2, (150, 500)),
+    ('Children', 3, (24, 120)),
+)
+
+# Genres per category with relative weights; "Fiction" dominates as in books.py
+GENRES = {
+    'Adult': {
+        'Fiction': 10, 'Fantasy': 6, 'Romance': 5, 'Nonfiction': 6, 'Self Help': 4, 'Psychology': 4,
+        'Personal Development': 3, 'Business': 4, 'Communication': 2, 'Dark Academia': 1, 'Magic': 2,
+        'Historical Fiction': 3, 'Productivity': 2, 'Leadership': 2, 'Mystery': 4, 'Thriller': 4,
+        'Science Fiction': 3, 'Poetry': 1, 'Biography': 2, 'History': 2,
+    },
+    'Teens': {
+        'Fiction': 10, 'Fantasy': 6, 'Graphic Novels': 4, 'Comics': 3, 'Romance': 3, 'Friendship': 3,
+        'Mystery': 3, 'Science Fiction': 2, 'School': 3, 'Mental Health': 2, 'Poetry': 1,
+    },
+    'Children': {
+        'Picture Books': 10, 'Fiction': 8, 'Animals': 5, 'Friendship': 4, 'School': 3, 'Emotion': 3,
+        'Grief': 1, 'Indigenous': 1, 'Poetry': 2, 'Magic': 2,
+    },
+}
+
+WORDS = (
+    "the a of and to in is was for on with as his her their that this from by at an be "
+    "library book story world magic hell professor rival journey soul mind field dream "
+    "kingdom villain frog office assistant prophecy dragon school friend family secret "
+    "night river city forest winter summer war peace love grief memory ocean island "
+    "students teacher garden house door return habit change success leader team courage "
+    "adventure mystery murder detective clue shadow light fire storm queen king witch "
+    "ghost heart promise letter voice song star moon sun mountain village road home"
+).split()
+
+FIRST_NAMES = (
+    "Alice Peter Hannah Joanna Caroline Dan Emily James Chris Tahl Rebecca Leigh Sarah "
+    "Maria John Ava Liam Noah Olivia Mia Ethan Zoe Lucas Nora Omar Priya Kenji Amara"
+).split()
+
+LAST_NAMES = (
+    "Kuang Maehrer Ho Pritchard Santat Tetri Clear Voss Raz Yarros Bardugo Adeyemi Mafi "
+    "Rooney Ishiguro Okafor Nguyen Silva Novak Haddad Tanaka Moreau Larsen Quinn Reyes"
+).split()
+
+COVER_URL = "https://images-na.ssl-images-amazon.com/images/S/compressed.photo.goodreads.com/books/{}.jpg"
+
+
+def _sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(8, 22))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng):
+    return " ".join(_sentence(rng) for _ in range(rng.randint(1, 4)))
+
+
+def generate(count, seed=1):
+    """Yield count synthetic books in the books.py format"""
+    rng = random.Random(seed)
+
+    # A long-tailed author pool: a few prolific authors, many with one book
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(10, count // 3))]
+    author_weights = list(accumulate(1 / (rank + 1) for rank in range(len(authors))))
+
+    categories = [category for category, _, _ in CATEGORIES]
+    category_weights = [weight for _, weight, _ in CATEGORIES]
+    page_ranges = {category: pages for category, _, pages in CATEGORIES}
+
+    for index in range(count):
+        category = rng.choices(categories, category_weights)[0]
+        genre_names = list(GENRES[category])
+        genre_weights = list(GENRES[category].values())
+
+        genres = []
+        wanted = rng.randint(3, min(6, len(genre_names)))
+        while len(genres) < wanted:
+            genre = rng.choices(genre_names, genre_weights)[0]
+            if genre not in genres:
+                genres.append(genre)
+
+        copies = rng.randint(1, 5)
+        low, high = page_ranges[category]
+        title_words = rng.sample(WORDS[20:], rng.randint(1, 5))
+
+        yield {
+            'genres': genres,
+            'title': " ".join(word.capitalize() for word in title_words) + f" {index + 1}",
+            'category': category,
+            'url': COVER_URL.format(1700000000 + index),
+            'description': [_paragraph(rng) for _ in range(rng.randint(3, 6))],
+            'authors': list(dict.fromkeys(rng.choices(authors, cum_weights=author_weights, k=rng.choice((1, 1, 1, 2, 3))))),
+            'pages': rng.randint(low, high),
+            'available': rng.randint(0, copies),
+            'copies': copies,
+        }
+
+
+def write(books, path):
+    """Write books to a .snap snapshot or a .jsonl file, chosen by extension"""
+    if path.endswith('.snap'):
+        # Imported here so bench.run can load another revision's snapshot module
+        from snapshot import build
+        build(list(books), path)
+    elif path.endswith('.jsonl'):
+        with open(path, 'w', encoding='utf-8') as stream:
+            for book in books:
+                stream.write(json.dumps(book) + '\n')
+    else:
+        raise SystemExit(f"unsupported output format: {path} (use .snap or .jsonl)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic catalog")
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', required=True, help="a .snap snapshot or .jsonl file")
+    args = parser.parse_args(argv)
+
+    write(generate(args.books, args.seed), args.output)
+    print(f"Wrote {args.books:,} books to {args.output} ({os.path.getsize(args.output):,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""Request-level benchmarks for the library app.
+
+Generates (or reuses) a synthetic catalog snapshot, points the app at it
+and drives each scenario through the WSGI app in-process, or through a
+local HTTP server with --http. Throughput, latency percentiles, response
+sizes and peak memory are printed and saved as JSON so runs can be
+compared between commits:
+
+    python -m bench.run --books 200000 --output before.json
+    python -m bench.run --books 200000 --output after.json --compare before.json
+
+Every request carries a unique bench=N argument, so the rendered page
+cache cannot answer it and each scenario measures real renders;
+--repeat-urls measures cache hits instead.
+
+To benchmark another revision, check it out into a worktree and point
+--app at it (the harness itself always runs from this checkout):
+
+    git worktree add /tmp/before <revision>
+    python -m bench.run --app /tmp/before --output before.json
+
+Revisions that predate a feature degrade instead of failing. Without
+snapshot.py the synthetic catalog is handed to the app as its books module.
+Scenarios whose route the revision does not have are skipped, and so is
+titles-next-page before cursor pagination. --no-cache is ignored if there
+is no page cache.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from itertools import chain
+from urllib.parse import quote
+
+from werkzeug.exceptions import NotFound
+
+from bench.generate import generate, write
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = (
+    'titles-all', 'titles-adult', 'titles-teens', 'titles-children', 'titles-next-page',
+    'details', 'search', 'suggest', 'facets', 'api-list', 'api-bulk', 'api-details',
+)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return 0.0
+    # Rounded first so 0.07 * 100 == 7.000000000000001 still picks rank 7
+    index = min(len(samples) - 1, max(0, math.ceil(round(fraction * len(samples), 9)) - 1))
+    return samples[index]
+
+
+def catalog_size(app_module):
+    """Number of books the app serves, whichever revision it is"""
+    # The repository from the SQLite backend on, the catalog index before it, the raw list before that
+    for name in ('repository', 'catalog'):
+        source = getattr(app_module, name, None)
+        if source is not None:
+            return len(source)
+    return len(app_module.all_books)
+
+
+def first_page_cursor(app_module):
+    """Cursor of the second /book-titles page, or None before cursor pagination"""
+    for name in ('repository', 'catalog'):
+        source = getattr(app_module, name, None)
+        if source is not None and hasattr(source, 'page'):
+            return source.page(limit=app_module.app.config['BOOKS_PER_PAGE'])[2]
+    return None
+
+
+def has_route(app, path):
+    try:
+        app.url_map.bind('localhost').match(path.split('?', 1)[0])
+    except NotFound:
+        return False
+    except Exception:
+        # Redirects and method mismatches still mean the route exists
+        return True
+    return True
+
+
+def scenario_urls(name, app_module, rng, repeat=False):
+    """Endless iterator of request paths for a scenario, or None if the app revision lacks it"""
+    if name == 'titles-next-page':
+        cursor = first_page_cursor(app_module)
+        if cursor is None:
+            return None
+        paths = _repeat(f'/book-titles?after={cursor}')
+    else:
+        paths = _scenario_paths(name, catalog_size(app_module), rng)
+
+    first = next(paths)
+    if not has_route(app_module.app, first):
+        return None
+    paths = chain([first], paths)
+    if repeat:
+        return paths
+    # A unique argument per request keeps the page cache from answering it
+    return (f"{path}{'&' if '?' in path else '?'}bench={number}" for number, path in enumerate(paths))
+
+
+def _repeat(path):
+    while True:
+        yield path
+
+
+def _scenario_paths(name, books, rng):
+    # Every revision numbers books from 1 in catalog order
+    ids = [str(book_id) for book_id in range(1, books + 1)]
+    words = ['magic', 'dragon', 'library', 'secret', 'kingdom', 'ghost', 'winter', 'friend']
+
+    if name.startswith('titles-'):
+        yield from _repeat(f"/book-titles?category={name.split('-', 1)[1]}")
+
+    while True:
+        if name == 'details':
+            yield f'/book-details/{rng.choice(ids)}'
+        elif name == 'search':
+            yield f'/book-titles?q={rng.choice(words)}'
+        elif name == 'suggest':
+            word = rng.choice(words)
+            yield f'/api/suggest?q={quote(word[:rng.randint(1, len(word))])}'
+        elif name == 'facets':
+            yield f'/book-titles?genre=Fantasy&genre=Romance&available=1&pages={rng.choice(["100-299", "300-499"])}'
+        elif name == 'api-list':
+            yield '/api/books?limit=50'
+        elif name == 'api-bulk':
+            yield '/api/books?ids=' + ','.join(rng.sample(ids, min(20, len(ids))))
+        elif name == 'api-details':
+            yield f'/api/books/{rng.choice(ids)}?fields=title,description'
+        else:
+            raise ValueError(f"unknown scenario {name}")
+
+
+class InProcessDriver:
+    """Calls the WSGI app directly through werkzeug's test client"""
+
+    def __init__(self, app):
+        from werkzeug.test import Client
+        self.client = Client(app)
+
+    def get(self, path, headers):
+        response = self.client.get(path, headers=headers)
+        body = response.get_data()
+        return response.status_code, len(body)
+
+    def close(self):
+        pass
+
+
+class HttpDriver:
+    """Sends real HTTP requests to the app served by a local threaded WSGI server"""
+
+    def __init__(self, app):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+
+    def get(self, path, headers):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, len(body)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_scenario(driver, urls, requests, concurrency, headers):
+    """Issue requests across concurrency threads; return latencies (seconds), sizes and errors"""
+    latencies, sizes, errors = [], [], [0]
+    lock = threading.Lock()
+    url_lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with url_lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                path = next(urls)
+            started = time.perf_counter()
+            status, size = driver.get(path, headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(size)
+                if status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sizes, errors[0], time.perf_counter() - started
+
+
+def git_revision(path):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=path).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_snapshot(args, app_dir):
+    """Path of a synthetic snapshot in the format of app_dir's snapshot.py, building it if needed"""
+    with open(os.path.join(app_dir, 'snapshot.py'), 'rb') as stream:
+        # The format can change between revisions, so each snapshot.py gets its own file
+        digest = hashlib.sha1(stream.read()).hexdigest()[:10]
+    name = f'bench-catalog-{args.books}-{args.seed}'
+    path = os.path.join(tempfile.gettempdir(), f'{name}-{digest}.snap')
+    if not os.path.exists(path):
+        source = os.path.join(tempfile.gettempdir(), f'{name}.jsonl')
+        if not os.path.exists(source):
+            print(f"Generating {args.books:,} books into {source}...", file=sys.stderr)
+            write(generate(args.books, args.seed), source)
+        # Built by the revision's own snapshot.py
+        subprocess.run([sys.executable, 'snapshot.py', 'build', source, path], cwd=app_dir, check=True,
+                       stdout=subprocess.DEVNULL)
+    return path
+
+
+def books_module(args):
+    """A stand-in books module holding the synthetic catalog, for revisions without snapshots"""
+    module = types.ModuleType('books')
+    module.all_books = list(generate(args.books, args.seed))
+    return module
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as stream:
+        baseline = {scenario['name']: scenario for scenario in json.load(stream)['scenarios']}
+
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'scenario':<18} {'req/s':>10} {'p50':>9} {'p99':>9}")
+    for scenario in results['scenarios']:
+        before = baseline.get(scenario['name'])
+        if before is None:
+            continue
+        changes = [
+            scenario['throughput'] / before['throughput'] - 1 if before['throughput'] else 0,
+            scenario['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0,
+            scenario['p99_ms'] / before['p99_ms'] - 1 if before['p99_ms'] else 0,
+        ]
+        print(f"{scenario['name']:<18} " + " ".join(f"{change:>+9.1%}" for change in changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library app against a synthetic catalog")
+    parser.add_argument('--books', type=int, default=10000, help="synthetic catalog size (10 to 1,000,000)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--snapshot', help="benchmark an existing snapshot instead of generating one")
+    parser.add_argument('--app', default=ROOT, help="checkout of the app revision to benchmark (default: this one)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help="measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--http', action='store_true', help="go through a local HTTP server")
+    parser.add_argument('--no-cache', action='store_true', help="disable the rendered page cache")
+    parser.add_argument('--repeat-urls', action='store_true',
+                        help="reuse each scenario's URLs, measuring page cache hits rather than renders")
+    parser.add_argument('--gzip', action='store_true', help="send Accept-Encoding: gzip")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="also report Python heap peaks per scenario (slows requests down)")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="print changes against an earlier JSON result")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.abspath(args.app)
+    sys.path.insert(0, app_dir)
+    if os.path.exists(os.path.join(app_dir, 'snapshot.py')):
+        os.environ['CATALOG_SNAPSHOT'] = args.snapshot or prepare_snapshot(args, app_dir)
+    elif args.snapshot:
+        parser.error(f"{app_dir} predates catalog snapshots")
+    else:
+        # Revisions from before snapshots import books.py; hand them the synthetic catalog instead
+        sys.modules['books'] = books_module(args)
+
+    started = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - started
+    startup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    page_cache = getattr(app_module, 'page_cache', None)
+    if args.no_cache and page_cache is None:
+        print("This revision has no page cache; ignoring --no-cache", file=sys.stderr)
+    elif args.no_cache:
+        page_cache.max_bytes = page_cache.max_entry_bytes = 0
+
+    driver = HttpDriver(app_module.app) if args.http else InProcessDriver(app_module.app)
+    headers = {'Accept-Encoding': 'gzip'} if args.gzip else {}
+    rng = random.Random(args.seed)
+
+    results = {
+        'revision': git_revision(app_dir),
+        'python': platform.python_version(),
+        'books': catalog_size(app_module),
+        'seed': args.seed,
+        'mode': 'http' if args.http else 'wsgi',
+        'concurrency': args.concurrency,
+        'page_cache': page_cache is not None and not args.no_cache,
+        'repeat_urls': args.repeat_urls,
+        'gzip': args.gzip,
+        'startup_seconds': startup,
+        'startup_peak_rss_kb': startup_rss,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'scenarios': [],
+    }
+
+    print(f"{catalog_size(app_module):,} books, started in {startup:.2f}s")
+    print(f"{'scenario':<18} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'avg KB':>9} {'errors':>7}")
+
+    for name in args.scenarios:
+        urls = scenario_urls(name, app_module, rng, args.repeat_urls)
+        if urls is None:
+            print(f"{name:<18} {'not available in this revision':>30}")
+            continue
+        run_scenario(driver, urls, args.warmup, args.concurrency, headers)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        latencies, sizes, errors, elapsed = run_scenario(driver, urls, args.requests, args.concurrency, headers)
+        heap_peak = None
+        if args.tracemalloc:
+            heap_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        latencies.sort()
+        scenario = {
+            'name': name,
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'mean_bytes': sum(sizes) / len(sizes) if sizes else 0,
+            'heap_peak_bytes': heap_peak,
+            # ru_maxrss is the whole process's high-water mark, so it never
+            # falls between scenarios; heap_peak_bytes is this scenario's own
+            'cumulative_peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        results['scenarios'].append(scenario)
+        print(f"{name:<18} {scenario['throughput']:>10,.1f} {scenario['p50_ms']:>9.2f} {scenario['p95_ms']:>9.2f} "
+              f"{scenario['p99_ms']:>9.2f} {scenario['max_ms']:>9.2f} {scenario['mean_bytes'] / 1024:>9.1f} {errors:>7}")
+
+    driver.close()
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak RSS: {results['peak_rss_kb'] / 1024:,.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import base64
+import json
+import threading
+import time
+from bisect import bisect_right
+from types import MappingProxyType
+
+
+def sort_key(book):
+    """Unique sort key for a book: case-insensitive title, then numeric ID"""
+    return (book['title'].lower(), int(book['id']))
+
+
+def encode_cursor(key):
+    """Turn a sort key into an opaque, URL-safe pagination token"""
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Turn a pagination token back into a sort key (None if missing or invalid)"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        title, book_id = json.loads(raw)
+        return (str(title), int(book_id))
+    except (ValueError, TypeError):
+        return None
+
+
+class CatalogIndex:
+    """Precomputed, read-only view of the catalog built once and shared by all requests.
+
+    The index holds the processed book records, the title sort order, a
+    posting list per category and an id -> record map. Requests only ever
+    slice or look up into it; call rebuild() (or invalidate() for a lazy
+    rebuild) whenever the underlying catalog changes.
+    """
+
+    def __init__(self, load_records):
+        # load_records() must return the list of processed book records
+        self._load_records = load_records
+        self._lock = threading.Lock()
+        self._state = None
+        self._version = 0
+        self._modified = None
+
+    def _build(self):
+        records = self._load_records()
+
+        # Sort once by title; every listing is a slice of this order
+        ordered = tuple(sorted(records, key=sort_key))
+
+        by_category = {}
+        for book in ordered:
+            by_category.setdefault(book['category'].lower(), []).append(book)
+        by_category = {name: tuple(books) for name, books in by_category.items()}
+
+        by_id = {book['id']: book for book in ordered}
+
+        return ordered, MappingProxyType(by_category), MappingProxyType(by_id)
+
+    def _current(self):
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    self._swap(self._build())
+                state = self._state
+        return state
+
+    def _swap(self, state):
+        self._state = state
+        self._version += 1
+        self._modified = time.time()
+
+    @property
+    def version(self):
+        """Counter bumped every time the index is (re)built"""
+        self._current()
+        return self._version
+
+    @property
+    def modified(self):
+        """Unix time the current index was built"""
+        self._current()
+        return self._modified
+
+    def rebuild(self):
+        """Rebuild the index now and swap it in atomically"""
+        state = self._build()
+        with self._lock:
+            self._swap(state)
+
+    def invalidate(self):
+        """Drop the current index; it is rebuilt on the next access"""
+        with self._lock:
+            self._state = None
+
+    def all(self):
+        """All books sorted alphabetically by title"""
+        return self._current()[0]
+
+    def by_category(self, category):
+        """Books in a category (case-insensitive), sorted by title"""
+        return self._current()[1].get(category.lower(), ())
+
+    def get(self, book_id):
+        """Look up a single book by its string ID"""
+        return self._current()[2].get(str(book_id))
+
+    def page(self, category=None, after=None, limit=None):
+        """Return (books, count, next_cursor) for one page of a listing in title order.
+
+        after is a sort key (see decode_cursor) and the page starts right
+        behind it; limit=None runs to the end of the listing. books is a lazy
+        iterator over the shared records, so no per-request copy is made.
+        """
+        if category and category.lower() != 'all':
+            listing = self.by_category(category)
+        else:
+            listing = self.all()
+
+        start = bisect_right(listing, after, key=sort_key) if after else 0
+        end = len(listing) if limit is None else min(start + limit, len(listing))
+        end = max(start, end)
+
+        next_cursor = None
+        if start < end < len(listing):
+            next_cursor = encode_cursor(sort_key(listing[end - 1]))
+
+        books = (listing[position] for position in range(start, end))
+        return books, end - start, next_cursor
+
+    def categories(self):
+        """Lower-cased names of all categories present in the catalog"""
+        return tuple(self._current()[1])
+
+    def __len__(self):
+        return len(self.all())
@@ -0,0 +1,430 @@
+import json
+import os
+import threading
+from collections import deque
+
+
+class CirculationError(Exception):
+    """A checkout, return or hold that cannot be carried out"""
+
+
+class UnknownBook(CirculationError):
+    pass
+
+
+class LogUnavailable(CirculationError):
+    """The write-ahead log has failed or been closed, so nothing can be made durable"""
+
+
+class WriteAheadLog:
+    """Append-only JSON-lines log with group commit.
+
+    Writers append a record and then wait for it to become durable. A
+    single flusher thread writes everything queued so far with one write()
+    and one fsync(), so under load hundreds of operations share each fsync
+    instead of paying for one each.
+    """
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.batches = 0
+        self._stream = open(path, 'ab')
+        # A crash mid-write can leave a torn final line; new records must not be glued onto it
+        end = self._stream.seek(0, os.SEEK_END)
+        complete = self._complete_length(path, end)
+        if complete < end:
+            self._stream.truncate(complete)
+        self._pending = []
+        self._next_seq = 1
+        self._durable_seq = 0
+        self._error = None
+        self._closed = False
+        self._lock = threading.Lock()
+        # Held while the file itself is written, so compact() can swap it safely
+        self._io_lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._flusher = threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True)
+        self._flusher.start()
+
+    def append(self, record):
+        """Queue a record and return its sequence number (see wait())"""
+        line = self._encode(record)
+        with self._lock:
+            self._check()
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending.append(line)
+            self._queued.notify()
+        return seq
+
+    def wait(self, seq):
+        """Block until the record with this sequence number is on disk"""
+        with self._lock:
+            while self._durable_seq < seq and self._error is None:
+                self._committed.wait()
+            if self._durable_seq < seq:
+                self._check()
+
+    def check(self):
+        """Raise LogUnavailable if records can no longer be written"""
+        with self._lock:
+            self._check()
+
+    def _check(self):
+        if self._error is not None:
+            raise LogUnavailable(f"write-ahead log failed: {self._error}")
+        if self._closed:
+            raise LogUnavailable("write-ahead log is closed")
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._queued.wait()
+                if not self._pending and self._closed:
+                    return
+                batch = self._pending
+                self._pending = []
+                last_seq = self._next_seq - 1
+
+            # Writing and syncing happen outside the lock so new records keep queueing
+            try:
+                with self._io_lock:
+                    self._stream.write(b''.join(batch))
+                    self._stream.flush()
+                    if self.sync:
+                        os.fsync(self._stream.fileno())
+            except OSError as error:
+                with self._lock:
+                    self._error = error
+                    self._committed.notify_all()
+                return
+
+            with self._lock:
+                self.batches += 1
+                self._durable_seq = last_seq
+                self._committed.notify_all()
+
+    def compact(self, record):
+        """Drop every line before a record that is already on disk (see wait())"""
+        line = self._encode(record)
+        with self._io_lock:
+            with open(self.path, 'rb') as stream:
+                data = stream.read()
+            start = 0 if data.startswith(line) else data.find(b'\n' + line) + 1
+            if start <= 0:
+                return
+            replacement = f'{self.path}.tmp'
+            with open(replacement, 'wb') as stream:
+                stream.write(data[start:])
+                stream.flush()
+                if self.sync:
+                    os.fsync(stream.fileno())
+            os.replace(replacement, self.path)
+            stream = open(self.path, 'ab')
+            self._stream.close()
+            self._stream = stream
+
+    def close(self):
+        """Flush everything still queued and close the log"""
+        with self._lock:
+            self._closed = True
+            self._queued.notify()
+        self._flusher.join()
+        self._stream.close()
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    @staticmethod
+    def _complete_length(path, end, chunk_size=4096):
+        # Offset just past the last newline, read backwards from the end of the file
+        with open(path, 'rb') as stream:
+            position = end
+            while position > 0:
+                size = min(chunk_size, position)
+                position -= size
+                stream.seek(position)
+                newline = stream.read(size).rfind(b'\n')
+                if newline != -1:
+                    return position + newline + 1
+        return 0
+
+    @staticmethod
+    def replay(path):
+        """Yield the records of an existing log, ignoring a torn final line"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as stream:
+            for line in stream:
+                if not line.endswith(b'\n'):
+                    break
+                yield json.loads(line)
+
+
+class _Copies:
+    __slots__ = ('copies', 'available', 'holds', 'ready')
+
+    def __init__(self, copies, available):
+        self.copies = copies
+        self.available = available
+        # Patrons waiting for a copy, and patrons a returned copy is set aside for
+        self.holds = deque()
+        self.ready = []
+
+
+class CirculationEngine:
+    """Checkout, return and hold operations on the catalog's copy counts.
+
+    Every book's counters are guarded by one of a fixed set of striped
+    locks, so operations on different books never contend on a global
+    lock. Each change is applied in memory and queued in the write-ahead
+    log while the stripe is held (keeping the log in per-book order), then
+    on_change is called and the caller waits for the group commit outside
+    the lock. Once the log has failed every new operation is refused
+    before it changes anything, so memory only runs ahead of the log by
+    the operations that were in flight at the time.
+
+    Every checkpoint_every operations the counts of the books used so far
+    are saved next to the log and the records they cover are dropped, so
+    open() replays a short log instead of every operation ever made.
+    """
+
+    def __init__(self, log_path=None, stripes=64, sync=True, on_change=None, checkpoint_every=10000):
+        self.log_path = log_path
+        self.sync = sync
+        self.on_change = on_change
+        self.checkpoint_every = checkpoint_every
+        self._books = {}
+        # Books whose counts may differ from the catalog's, i.e. the ones a checkpoint saves
+        self._touched = set()
+        self._lookup = None
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._log = None
+        self._epoch = 0
+        self._checkpoint_due = checkpoint_every
+        self._checkpointing = threading.Lock()
+
+    def _lock_for(self, book_id):
+        return self._locks[hash(book_id) % len(self._locks)]
+
+    def _state(self, book_id):
+        state = self._books.get(book_id)
+        if state is None:
+            counts = self._lookup(book_id) if self._lookup is not None else None
+            if counts is None:
+                raise UnknownBook(f"no book with ID {book_id}")
+            # Two threads meeting a new book at once still end up with the same state
+            state = self._books.setdefault(book_id, _Copies(*counts))
+        return state
+
+    def seed(self, books):
+        """Start tracking the copy counts of catalog records.
+
+        Books already tracked keep their live counts; a change in the number
+        of copies is applied to the available count as well.
+        """
+        for book in books:
+            with self._lock_for(book['id']):
+                state = self._books.get(book['id'])
+                if state is None:
+                    self._books[book['id']] = _Copies(book['copies'], book['available'])
+                elif state.copies != book['copies']:
+                    state.available = max(0, min(book['copies'], state.available + book['copies'] - state.copies))
+                    state.copies = book['copies']
+
+    def seed_lazily(self, lookup):
+        """Track books from their first use on, instead of seeding them all up front.
+
+        lookup(book_id) returns the (copies, available) a book starts with,
+        or None if there is no such book.
+        """
+        self._lookup = lookup
+
+    @property
+    def checkpoint_path(self):
+        return f'{self.log_path}.checkpoint'
+
+    def open(self):
+        """Load the last checkpoint, replay the log after it and start logging new operations"""
+        if not self.log_path:
+            return
+        saved = self._load_checkpoint()
+        self._epoch = saved
+        # Records before the checkpoint's marker are already part of it
+        replaying = saved == 0
+        for record in WriteAheadLog.replay(self.log_path):
+            if record['op'] == 'checkpoint':
+                replaying = replaying or record['epoch'] == saved
+                # Markers of checkpoints that were never saved must not be reused
+                self._epoch = max(self._epoch, record['epoch'])
+                continue
+            if not replaying:
+                continue
+            try:
+                self._apply(record['op'], record['book'], record.get('patron'))
+            except CirculationError:
+                # The book left the catalog (or its copies shrank) since this was logged
+                continue
+        self._log = WriteAheadLog(self.log_path, sync=self.sync)
+        self._checkpoint_due = self.checkpoint_every
+
+    def _load_checkpoint(self):
+        # Returns the epoch of the checkpoint, 0 if there is none
+        try:
+            with open(self.checkpoint_path) as stream:
+                checkpoint = json.load(stream)
+        except FileNotFoundError:
+            return 0
+        for book_id, (copies, available, holds, ready) in checkpoint['books'].items():
+            try:
+                state = self._state(book_id)
+            except UnknownBook:
+                continue
+            # As in seed(), a change in the number of copies since then moves the available count too
+            state.available = max(0, min(state.copies, available + state.copies - copies))
+            state.holds = deque(holds)
+            state.ready = list(ready)
+            self._touched.add(book_id)
+        return checkpoint['epoch']
+
+    def checkpoint(self):
+        """Save the current counts and drop the log records they cover"""
+        with self._checkpointing:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # With every stripe held no operation is half done, so the marker
+        # splits the log into records the saved counts include and records they do not
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            if self._log is None:
+                raise LogUnavailable("write-ahead log is not open")
+            self._log.check()
+            self._epoch += 1
+            marker = {'op': 'checkpoint', 'epoch': self._epoch}
+            books = {}
+            for book_id in self._touched:
+                state = self._books[book_id]
+                books[book_id] = [state.copies, state.available, list(state.holds), list(state.ready)]
+            seq = self._log.append(marker)
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+        # A crash before the log is compacted replays from the marker onwards
+        self._log.wait(seq)
+        replacement = f'{self.checkpoint_path}.tmp'
+        with open(replacement, 'w') as stream:
+            json.dump({'epoch': self._epoch, 'books': books}, stream, separators=(',', ':'))
+            stream.flush()
+            if self.sync:
+                os.fsync(stream.fileno())
+        os.replace(replacement, self.checkpoint_path)
+        self._log.compact(marker)
+
+    def _checkpoint_in_background(self):
+        try:
+            self._checkpoint()
+        except (CirculationError, OSError):
+            # The log still holds every record, so the next checkpoint covers these too
+            pass
+        finally:
+            self._checkpointing.release()
+
+    def close(self):
+        if self._log is not None:
+            # Let a checkpoint in progress finish first
+            with self._checkpointing:
+                self._log.close()
+                self._log = None
+
+    @property
+    def commits(self):
+        """Number of group commits (fsyncs) made since open()"""
+        return self._log.batches if self._log is not None else 0
+
+    def available(self, book_id):
+        return self._state(book_id).available
+
+    def status(self, book_id):
+        """Current counts for a book as a dict"""
+        state = self._state(book_id)
+        with self._lock_for(book_id):
+            return {
+                'id': book_id,
+                'copies': state.copies,
+                'available': state.available,
+                'holds': len(state.holds),
+                'ready': len(state.ready),
+            }
+
+    def checkout(self, book_id, patron=None):
+        """Lend a copy; a patron with a copy set aside for them gets that copy"""
+        return self._run('checkout', book_id, patron)
+
+    def return_copy(self, book_id, patron=None):
+        """Take a copy back; it goes to the first waiting hold, if any"""
+        return self._run('return', book_id, patron)
+
+    def place_hold(self, book_id, patron):
+        """Queue a patron for the next returned copy"""
+        if not patron:
+            raise CirculationError("a hold needs a patron")
+        return self._run('hold', book_id, patron)
+
+    def _run(self, op, book_id, patron):
+        seq = None
+        with self._lock_for(book_id):
+            if self._log is not None:
+                self._log.check()
+            result = self._apply(op, book_id, patron)
+            if self._log is not None:
+                seq = self._log.append({'op': op, 'book': book_id, 'patron': patron})
+
+        # Listeners read the current counts themselves, so they need no lock
+        if self.on_change is not None:
+            self.on_change(book_id)
+        # Wait for the group commit outside the stripe lock
+        if seq is not None:
+            self._log.wait(seq)
+            if seq >= self._checkpoint_due and self._checkpointing.acquire(blocking=False):
+                self._checkpoint_due = seq + self.checkpoint_every
+                threading.Thread(target=self._checkpoint_in_background, name='circulation-checkpoint',
+                                 daemon=True).start()
+        return result
+
+    def _apply(self, op, book_id, patron):
+        # Callers hold the book's stripe lock (or are single-threaded during replay)
+        state = self._state(book_id)
+        self._touched.add(book_id)
+
+        if op == 'checkout':
+            if patron is not None and patron in state.ready:
+                state.ready.remove(patron)
+            elif state.available > 0:
+                state.available -= 1
+            else:
+                raise CirculationError(f"no copies of book {book_id} are available")
+            return state.available
+
+        if op == 'return':
+            if state.available + len(state.ready) >= state.copies:
+                raise CirculationError(f"all copies of book {book_id} are already in")
+            if state.holds:
+                state.ready.append(state.holds.popleft())
+            else:
+                state.available += 1
+            return state.available
+
+        if op == 'hold':
+            if patron in state.holds or patron in state.ready:
+                raise CirculationError(f"{patron} already has a hold on book {book_id}")
+            state.holds.append(patron)
+            return len(state.holds)
+
+        raise CirculationError(f"unknown operation {op!r}")
@@ -0,0 +1,297 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, chain, islice
+
+from catalog import encode_cursor, sort_key
+
+# Page-count buckets offered as a facet: (key, label, lowest, highest)
+PAGE_RANGES = (
+    ('under-100', 'Under 100', 0, 99),
+    ('100-299', '100 - 299', 100, 299),
+    ('300-499', '300 - 499', 300, 499),
+    ('500-plus', '500+', 500, None),
+)
+
+FACET_FIELDS = ('category', 'genre', 'author', 'pages', 'available')
+
+# Fields with more values than this only get counts for their most common values
+FACET_SCAN_LIMIT = 50
+# Selections of up to this many books have those values picked exactly, from the
+# books' own values; larger ones from a sample of about this many of their books
+FACET_TALLY_LIMIT = 2000
+FACET_SAMPLE_WINDOWS = 16
+
+
+def _page_range(pages):
+    for key, label, lowest, highest in PAGE_RANGES:
+        if pages >= lowest and (highest is None or pages <= highest):
+            return key
+    return None
+
+
+def _facet_values(book):
+    """The (field, value) pairs a processed book is filed under"""
+    yield 'category', book['category'].lower()
+    for genre in book['genre_list']:
+        yield 'genre', genre
+    for author in book['author_list']:
+        yield 'author', author
+    if isinstance(book['pages'], int):
+        page_range = _page_range(book['pages'])
+        if page_range:
+            yield 'pages', page_range
+    if book['available'] > 0:
+        yield 'available', 'available'
+
+
+class FacetIndex:
+    """Per-value bitsets over the catalog's title order for faceted filtering.
+
+    Bit N of every set stands for the Nth book in title order, so AND/OR of
+    filters is a word-parallel operation on Python ints and walking the set
+    bits yields results already sorted by title. Values that only cover a
+    handful of books are kept as sorted position arrays instead of bitsets
+    (a sparse bitset of a million books would still cost 125 KB).
+    """
+
+    def __init__(self, books, version=None):
+        self.books = books
+        self.version = version
+        # Serialises set_member() calls; readers only ever see a whole mask
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._sets = {field: {} for field in FACET_FIELDS}
+        self._labels = {field: {} for field in FACET_FIELDS}
+        self._labels['pages'] = {key: label for key, label, _, _ in PAGE_RANGES}
+        self._labels['available'] = {'available': 'Available now'}
+
+        # One pass over the books, so a lazily loaded catalog is only read once
+        postings = {field: {} for field in FACET_FIELDS}
+        for position, book in enumerate(books):
+            self._positions[book['id']] = position
+            for field, value in _facet_values(book):
+                postings[field].setdefault(value, []).append(position)
+            self._labels['category'].setdefault(book['category'].lower(), book['category'])
+
+        for field, values in postings.items():
+            for value, positions in values.items():
+                self._sets[field][value] = self._compact(positions)
+
+        # Values ordered by overall popularity, used to pick which counts to compute
+        self._popular = {
+            field: sorted(values, key=lambda value: (-len(values[value]), value))
+            for field, values in postings.items()
+        }
+        # Fields with too many values to count them all also keep each book's
+        # values by position, so the common values of a selection can be tallied
+        self._by_position = {
+            field: self._values_by_position(values)
+            for field, values in postings.items() if len(values) > FACET_SCAN_LIMIT
+        }
+        self._all = (1 << len(books)) - 1
+
+    def _values_by_position(self, values):
+        # (offsets, value numbers, names): the values of the book at position N are
+        # names[number] for the numbers between offsets[N] and offsets[N + 1]
+        owned = [[] for _ in range(len(self.books))]
+        for number, positions in enumerate(values.values()):
+            for position in positions:
+                owned[position].append(number)
+        return (array('I', accumulate(map(len, owned), initial=0)),
+                array('I', chain.from_iterable(owned)), list(values))
+
+    def _compact(self, positions):
+        # A bitset costs len(books) / 8 bytes, a position array 4 bytes per book
+        if len(positions) * 32 >= len(self.books):
+            return self.mask_of_positions(positions)
+        return array('I', positions)
+
+    def mask_of_positions(self, positions):
+        """Build a bitset with the given title-order positions set"""
+        bits = bytearray((len(self.books) + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, 'little')
+
+    def mask_of(self, book_ids):
+        """Build a bitset of the given book IDs (unknown IDs are ignored)"""
+        positions = self._positions
+        return self.mask_of_positions(positions[book_id] for book_id in book_ids if book_id in positions)
+
+    def _value_mask(self, field, value):
+        entry = self._sets[field].get(value, 0)
+        if isinstance(entry, array):
+            return self.mask_of_positions(entry)
+        return entry
+
+    def _field_mask(self, field, values, match_all):
+        masks = [self._value_mask(field, value) for value in values]
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = mask & other if match_all else mask | other
+        return mask
+
+    def select(self, filters, match_all=(), within=None):
+        """Bitset of books matching filters ({field: [values]}); None if nothing is filtered.
+
+        Values of one field are OR-ed together unless the field is listed in
+        match_all; different fields are always AND-ed. within is an optional
+        bitset (e.g. search matches) the result is restricted to.
+        """
+        mask = within
+        for field, values in filters.items():
+            if not values:
+                continue
+            field_mask = self._field_mask(field, values, field in match_all)
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def counts(self, filters, match_all=(), within=None, limit=10):
+        """Facet counts for the current selection: {field: [(value, label, count), ...]}.
+
+        Each field is counted against the selection made by every *other*
+        field, so ticking a genre still shows how many books the remaining
+        genres would add.
+        """
+        results = {}
+        for field in FACET_FIELDS:
+            others = {name: values for name, values in filters.items() if name != field}
+            if field in match_all and filters.get(field):
+                # Ticking another value narrows the results, so count within them
+                others[field] = filters[field]
+            base = self.select(others, match_all, within)
+            if base is None:
+                base = self._all
+
+            selected = filters.get(field, ())
+            candidates = self._popular[field]
+            tallied = None
+            if len(candidates) > FACET_SCAN_LIMIT:
+                if base is self._all:
+                    # Nothing selected: overall popularity is the exact ranking
+                    candidates = candidates[:FACET_SCAN_LIMIT]
+                elif base.bit_count() <= FACET_TALLY_LIMIT:
+                    tallied = self._tally(field, self.iter_positions(base))
+                    candidates = list(tallied)
+                else:
+                    candidates = [value for value, _ in
+                                  self._tally(field, self._sample(base)).most_common(FACET_SCAN_LIMIT)]
+                candidates += [value for value in selected if value not in candidates]
+
+            base_bytes = None
+            counted = []
+            for value in candidates:
+                entry = self._sets[field].get(value)
+                if entry is None:
+                    continue
+                if tallied is not None:
+                    count = tallied[value]
+                elif isinstance(entry, array):
+                    if base_bytes is None:
+                        base_bytes = base.to_bytes((len(self.books) + 7) // 8, 'little')
+                    count = sum(base_bytes[position >> 3] >> (position & 7) & 1 for position in entry)
+                else:
+                    count = (base & entry).bit_count()
+                if count or value in selected:
+                    counted.append((value, self._labels[field].get(value, value), count))
+
+            if field != 'pages':
+                counted.sort(key=lambda item: (-item[2], item[1].lower()))
+            shown = counted[:limit]
+            shown += [item for item in counted[limit:] if item[0] in selected]
+            results[field] = shown
+        return results
+
+    def _tally(self, field, positions):
+        """Counter of the values of field over the books at positions"""
+        offsets, value_numbers, names = self._by_position[field]
+        tally = Counter()
+        for position in positions:
+            tally.update(value_numbers[offsets[position]:offsets[position + 1]])
+        return Counter({names[number]: count for number, count in tally.items()})
+
+    def _sample(self, mask):
+        """Positions of mask from evenly spread windows of the title order, about FACET_TALLY_LIMIT in all"""
+        size = len(self.books)
+        span = size // FACET_SAMPLE_WINDOWS
+        width = min(span, max(64, size * FACET_TALLY_LIMIT // (mask.bit_count() * FACET_SAMPLE_WINDOWS)))
+        for index in range(FACET_SAMPLE_WINDOWS):
+            start = index * span
+            for position in self.iter_positions((mask >> start) & ((1 << width) - 1)):
+                yield start + position
+
+    def set_member(self, field, value, book_id, present):
+        """Add a book to (or remove it from) one facet value, e.g. when it runs out of copies"""
+        position = self._positions.get(book_id)
+        if position is None:
+            return
+        with self._lock:
+            mask = self._value_mask(field, value)
+            if present:
+                mask |= 1 << position
+            else:
+                mask &= ~(1 << position)
+            self._sets[field][value] = mask
+
+    def __contains__(self, book_id):
+        return book_id in self._positions
+
+    def has(self, field, value, book_id):
+        """True if the book is filed under one facet value"""
+        position = self._positions.get(book_id)
+        entry = self._sets[field].get(value)
+        if position is None or entry is None:
+            return False
+        if isinstance(entry, array):
+            index = bisect_left(entry, position)
+            return index < len(entry) and entry[index] == position
+        return (entry >> position) & 1 == 1
+
+    def contains(self, mask, book_id):
+        """True if the book with this ID is in the bitset"""
+        position = self._positions.get(book_id)
+        return position is not None and (mask >> position) & 1 == 1
+
+    def iter_positions(self, mask, start=0):
+        """Yield the set positions of mask, in ascending (title) order, from start on"""
+        mask >>= start
+        words = mask.to_bytes(((mask.bit_length() + 63) // 64) * 8, 'little')
+        for index, word in enumerate(memoryview(words).cast('Q')):
+            base = start + index * 64
+            while word:
+                low = word & -word
+                yield base + low.bit_length() - 1
+                word ^= low
+
+    def _books_at(self, positions):
+        # Orders backed by a database (see repository.TitleOrder) fetch a whole page in one query
+        fetch = getattr(self.books, 'fetch', None)
+        if fetch is not None:
+            return fetch(positions)
+        return [self.books[position] for position in positions]
+
+    def _stream(self, positions, chunk_size=500):
+        while True:
+            chunk = list(islice(positions, chunk_size))
+            if not chunk:
+                return
+            yield from self._books_at(chunk)
+
+    def page(self, mask, after=None, limit=None):
+        """Return (books, count, next_cursor) for one page of a filtered listing, like CatalogIndex.page"""
+        books = self.books
+        start = bisect_right(books, after, key=sort_key) if after else 0
+        remaining = (mask >> start).bit_count()
+        count = remaining if limit is None else min(limit, remaining)
+
+        positions = self.iter_positions(mask, start)
+        if limit is None:
+            return self._stream(positions), count, None
+
+        page = self._books_at(list(islice(positions, count)))
+        next_cursor = None
+        if count < remaining:
+            next_cursor = encode_cursor(sort_key(page[-1]))
+        return iter(page), count, next_cursor
@@ -0,0 +1,327 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+
+ROUTE_KEY = 'library.route'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Metrics recorded into per-thread shards and merged only when scraped.
+
+    Every thread writes to its own dict of counters, so recording a sample
+    never takes a lock or contends with other request threads. A new thread
+    takes over the shard of one that has exited (its totals simply keep
+    growing), so a thread-per-request server never holds more shards than
+    it has live threads; dead shards left over are folded into a retired
+    total at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._derived = []
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            current = threading.current_thread()
+            with self._lock:
+                for index, (thread, owned) in enumerate(self._shards):
+                    if not thread.is_alive():
+                        shard = owned
+                        self._shards[index] = (current, shard)
+                        break
+                else:
+                    shard = {}
+                    self._shards.append((current, shard))
+            self._local.shard = shard
+        return shard
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self, name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def derived(self, name, help, callback, kind='gauge'):
+        """A metric whose value is read from callback() at scrape time"""
+        self._derived.append((name, help, kind, callback))
+
+    def _collect(self):
+        # Merge live shards with the retired total; fold dead threads in for good
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            merged = {key: list(values) for key, values in self._retired.items()}
+            for _, shard in live:
+                self._merge(merged, shard)
+        return merged
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, values in list(shard.items()):
+            total = into.get(key)
+            if total is None:
+                into[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    total[index] += value
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        samples = self._collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            series = sorted((key[1], values) for key, values in samples.items() if key[0] is metric)
+            for labels, values in series:
+                lines.extend(metric.render(labels, values))
+        for name, help, kind, callback in self._derived:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_number(callback())}')
+        return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are stored per bucket and summed into cumulative form on scrape"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.registry._shard()
+        key = (self, labels)
+        values = shard.get(key)
+        if values is None:
+            # One slot per bucket, one for +Inf, then the sum
+            values = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self, labels, values):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), values):
+            cumulative += count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else _number(bound))
+            yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+        yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-1])}'
+        yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self, labels)
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0]
+        values[0] += amount
+
+    def render(self, labels, values):
+        yield f'{self.name}{_labels(self.labelnames, labels)} {_number(values[0])}'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    'library_request_duration_seconds', "Time from the start of a request until its body was sent.", ('route',))
+PHASE_DURATION = registry.histogram(
+    'library_request_phase_seconds', "Time spent in each phase of a request (data, render, serialize).",
+    ('route', 'phase'))
+RESPONSE_SIZE = registry.histogram(
+    'library_response_size_bytes', "Size of response bodies as sent.", ('route',), buckets=SIZE_BUCKETS)
+RESPONSES = registry.counter(
+    'library_responses_total', "Responses by route and status code.", ('route', 'status'))
+
+
+@contextmanager
+def phase(name):
+    """Time a block of request work as one phase of the current route"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_DURATION.observe(time.perf_counter() - started, request.endpoint or 'unknown', name)
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight requests and dumps the slow ones.
+
+    A background thread looks at the stack of every thread that is serving a
+    request every interval seconds, and sleeps while none is. When a request
+    takes longer than threshold seconds its samples are appended to output
+    in the collapsed "frame;frame;frame count" format that flamegraph.pl and
+    speedscope read.
+    """
+
+    def __init__(self, threshold, output, interval=0.005):
+        self.threshold = threshold
+        self.output = output
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._busy = threading.Condition(self._lock)
+        # Keeps the dumps of concurrent slow requests from interleaving
+        self._output_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._sample_loop, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Tally()
+            self._busy.notify()
+
+    def stop(self, route, duration):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        # Written without holding _lock, so the sampler and other requests carry on meanwhile
+        if samples and duration >= self.threshold:
+            lines = ''.join(f'{route};{stack} {count}\n' for stack, count in samples.items())
+            with self._output_lock, open(self.output, 'a') as stream:
+                stream.write(lines)
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                idents = list(self._active)
+            # Stacks are walked outside the lock; only the tallies are updated under it
+            stacks = [(ident, self._collapse(frames[ident])) for ident in idents if ident in frames]
+            with self._lock:
+                for ident, stack in stacks:
+                    samples = self._active.get(ident)
+                    if samples is not None:
+                        samples[stack] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+class MetricsMiddleware:
+    """WSGI middleware timing each request until its (possibly streamed) body is fully sent"""
+
+    def __init__(self, wsgi_app, profiler=None):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = []
+
+        def recording_start_response(response_status, headers, exc_info=None):
+            status.append(response_status.split(' ', 1)[0])
+            return start_response(response_status, headers, exc_info)
+
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            body = self.wsgi_app(environ, recording_start_response)
+        except Exception:
+            self._finish(environ, started, '500', 0)
+            raise
+        return self._iterate(body, environ, started, status)
+
+    def _iterate(self, body, environ, started, status):
+        size = 0
+        try:
+            for chunk in body:
+                size += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            self._finish(environ, started, status[0] if status else '500', size)
+
+    def _finish(self, environ, started, status, size):
+        duration = time.perf_counter() - started
+        route = environ.get(ROUTE_KEY, 'unmatched')
+        REQUEST_DURATION.observe(duration, route)
+        RESPONSE_SIZE.observe(size, route)
+        RESPONSES.inc(route, status)
+        if self.profiler is not None:
+            self.profiler.stop(route, duration)
+
+
+def install(app, profiler=None):
+    """Instrument a Flask app and serve the collected metrics on /metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        # Lets the middleware label the request once it is done
+        request.environ[ROUTE_KEY] = request.endpoint or 'unmatched'
+
+    @app.after_request
+    def record_handler_time(response):
+        started = g.get('request_started')
+        if started is not None:
+            PHASE_DURATION.observe(time.perf_counter() - started, request.endpoint or 'unmatched', 'handler')
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, profiler)
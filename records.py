@@ -0,0 +1,226 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+DESCRIPTION_STORE_MAGIC = b'SGDESC1\0'
+
+# magic, description offset count, paragraph offset count, text buffer length
+DESCRIPTION_STORE_HEADER = struct.Struct('<8sQQQ')
+
+NO_DESCRIPTION = "No description available for this book."
+
+
+class DescriptionStore:
+    """Description paragraphs for the whole catalog in one contiguous UTF-8 buffer.
+
+    Paragraph N spans buffer[paragraphs[N]:paragraphs[N + 1]] and description
+    H is made of paragraphs descriptions[H] up to descriptions[H + 1]. Text is
+    only decoded when a page actually shows it. The store can be spilled to
+    disk and memory-mapped so the text lives in the OS page cache, shared by
+    every worker, instead of each worker's heap.
+    """
+
+    def __init__(self, buffer=None, paragraphs=None, descriptions=None):
+        self._buffer = bytearray() if buffer is None else buffer
+        self._paragraphs = array('Q', [0]) if paragraphs is None else paragraphs
+        self._descriptions = array('Q', [0]) if descriptions is None else descriptions
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._descriptions) - 1
+
+    @property
+    def nbytes(self):
+        return len(self._buffer)
+
+    def add(self, paragraphs):
+        """Append a description (a list of paragraphs or one string) and return its handle"""
+        if isinstance(paragraphs, str):
+            paragraphs = [paragraphs]
+        with self._lock:
+            if not isinstance(self._buffer, bytearray):
+                raise TypeError("description store is read-only")
+            for paragraph in paragraphs:
+                paragraph = paragraph.strip()
+                if paragraph:
+                    self._buffer += paragraph.encode('utf-8')
+                    self._paragraphs.append(len(self._buffer))
+            self._descriptions.append(len(self._paragraphs) - 1)
+            return len(self._descriptions) - 2
+
+    def paragraphs(self, handle):
+        """Decode the paragraphs of one description"""
+        first = self._descriptions[handle]
+        last = self._descriptions[handle + 1]
+        offsets = self._paragraphs
+        buffer = self._buffer
+        return [str(buffer[offsets[index]:offsets[index + 1]], 'utf-8') for index in range(first, last)]
+
+    def first_and_last(self, handle):
+        """Decode only the first and last paragraph of a description (for previews)"""
+        first = self._descriptions[handle]
+        last = self._descriptions[handle + 1]
+        if last - first <= 2:
+            return self.paragraphs(handle)
+        offsets = self._paragraphs
+        buffer = self._buffer
+        return [str(buffer[offsets[index]:offsets[index + 1]], 'utf-8') for index in (first, last - 1)]
+
+    def write(self, stream):
+        """Write the store in its on-disk layout"""
+        stream.write(DESCRIPTION_STORE_HEADER.pack(DESCRIPTION_STORE_MAGIC, len(self._descriptions),
+                                                   len(self._paragraphs), len(self._buffer)))
+        stream.write(array('Q', self._descriptions).tobytes())
+        stream.write(array('Q', self._paragraphs).tobytes())
+        stream.write(self._buffer)
+
+    @classmethod
+    def from_buffer(cls, view):
+        """Open a store laid out by write() inside a buffer (e.g. an mmap) without copying it"""
+        view = memoryview(view)
+        if len(view) < DESCRIPTION_STORE_HEADER.size:
+            raise ValueError("truncated description store")
+        magic, descriptions, paragraphs, size = DESCRIPTION_STORE_HEADER.unpack_from(view)
+        if magic != DESCRIPTION_STORE_MAGIC:
+            raise ValueError("not a description store")
+        start = DESCRIPTION_STORE_HEADER.size
+        if start + (descriptions + paragraphs) * 8 + size > len(view):
+            raise ValueError("truncated description store")
+        description_offsets = view[start:start + descriptions * 8].cast('Q')
+        start += descriptions * 8
+        paragraph_offsets = view[start:start + paragraphs * 8].cast('Q')
+        start += paragraphs * 8
+        return cls(view[start:start + size], paragraph_offsets, description_offsets)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a store saved with save()"""
+        with open(path, 'rb') as stream:
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        store = cls.from_buffer(mapped)
+        store._mmap = mapped
+        return store
+
+    def save(self, path):
+        """Write the store to path atomically.
+
+        Each call writes its own temporary file next to path, so several
+        processes saving to the same path at once never write into (or
+        truncate) a file another one has mapped.
+        """
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                                 prefix=os.path.basename(path) + '.')
+        try:
+            with os.fdopen(descriptor, 'wb') as stream:
+                self.write(stream)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def same_as(self, other):
+        """True if both stores hold the same descriptions under the same handles"""
+        return all(memoryview(mine).cast('B') == memoryview(theirs).cast('B') for mine, theirs in (
+            (self._descriptions, other._descriptions),
+            (self._paragraphs, other._paragraphs),
+            (self._buffer, other._buffer),
+        ))
+
+    def spill(self, path):
+        """Serve the store from a read-only memory map of path from now on.
+
+        The file is only written if it does not hold this store already, so
+        workers starting from the same catalog share the one another wrote.
+        """
+        try:
+            mapped = DescriptionStore.open(path)
+        except (OSError, ValueError):
+            mapped = None
+        if mapped is None or not self.same_as(mapped):
+            self.save(path)
+            mapped = DescriptionStore.open(path)
+        with self._lock:
+            self._buffer = mapped._buffer
+            self._paragraphs = mapped._paragraphs
+            self._descriptions = mapped._descriptions
+            self._mmap = mapped._mmap
+
+
+def _join(values):
+    return ", ".join(values)
+
+
+class Book:
+    """Compact, slotted catalog record.
+
+    Repeated strings (category, genres, authors) are interned so all books
+    share one copy, and the description text stays in a DescriptionStore
+    until a page asks for it. Records also answer book['field'] and
+    book.get('field') like the dicts they replace.
+    """
+
+    __slots__ = ('id', 'title', 'author_list', 'category', 'genre_list', 'pages',
+                 'copies', 'available', 'cover_image', '_descriptions', '_description')
+
+    def __init__(self, id, title, author_list, category, genre_list, pages, copies, available,
+                 cover_image, descriptions, description):
+        self.id = id
+        self.title = title
+        self.author_list = tuple(sys.intern(author) for author in author_list)
+        self.category = sys.intern(category)
+        self.genre_list = tuple(sys.intern(genre) for genre in genre_list)
+        self.pages = pages
+        self.copies = copies
+        self.available = available
+        self.cover_image = cover_image
+        self._descriptions = descriptions
+        self._description = description
+
+    def __repr__(self):
+        return f'<Book {self.id} {self.title!r}>'
+
+    # What book['...'] answers: the stored fields and the derived ones below
+    FIELDS = frozenset(('id', 'title', 'author_list', 'category', 'genre_list', 'pages', 'copies',
+                        'available', 'cover_image', 'author', 'genres', 'description_list',
+                        'description', 'formatted_description', 'description_preview'))
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    @property
+    def author(self):
+        return _join(self.author_list)
+
+    @property
+    def genres(self):
+        return _join(self.genre_list)
+
+    @property
+    def description_list(self):
+        return self._descriptions.paragraphs(self._description)
+
+    @property
+    def description(self):
+        return " ".join(self.description_list)
+
+    @property
+    def formatted_description(self):
+        """Full description with paragraph spacing, for the details page"""
+        paragraphs = self.description_list
+        return '<br><br>'.join(paragraphs) if paragraphs else NO_DESCRIPTION
+
+    @property
+    def description_preview(self):
+        """First and last paragraphs only, for the book titles page"""
+        paragraphs = self._descriptions.first_and_last(self._description)
+        return '<br><br>'.join(paragraphs) if paragraphs else NO_DESCRIPTION
@@ -0,0 +1,631 @@
+"""Catalog repositories: where book records are looked up and listed from.
+
+MemoryRepository answers from the in-process CatalogIndex and
+SnapshotRepository straight from a memory-mapped snapshot. SQLiteRepository
+keeps the catalog in a SQLite database file, so it survives restarts, can be
+updated without a redeploy and does not have to fit in memory:
+
+    python repository.py import books.py catalog.db
+    python repository.py import books.jsonl catalog.db
+
+Both return the same Book records (see records.py) with the same IDs, and
+page() uses the same keyset cursors as CatalogIndex.page(). A repository
+also carries the catalog version and modification time that caches and
+derived indexes (facets, search) are keyed on; call rebuild() after
+changing the catalog.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import islice
+
+from catalog import encode_cursor, sort_key
+from records import Book
+from snapshot import read_source
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    category TEXT NOT NULL,
+    category_key TEXT NOT NULL,
+    genres TEXT NOT NULL,
+    pages INTEGER,
+    copies INTEGER NOT NULL,
+    available INTEGER NOT NULL,
+    cover_image TEXT NOT NULL,
+    preview TEXT
+);
+CREATE INDEX IF NOT EXISTS books_by_title ON books (title_key, id);
+CREATE INDEX IF NOT EXISTS books_by_category ON books (category_key, title_key, id);
+CREATE TABLE IF NOT EXISTS descriptions (
+    book_id INTEGER PRIMARY KEY REFERENCES books (id),
+    paragraphs TEXT NOT NULL
+);
+"""
+
+# Everything a list page needs. Descriptions live in their own table so listings
+# never read (or page in) the full text; the preview column holds just the first
+# and last paragraphs list pages show (NULL in rows older than the column)
+BOOK_COLUMNS = 'id, title, authors, category, genres, pages, copies, available, cover_image, preview'
+
+# Most IDs bound in one "id IN (...)" query (SQLite's default limit is 999)
+MAX_BOUND_IDS = 500
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _preview(paragraphs):
+    """The paragraphs a list page shows: the first and last one"""
+    return paragraphs if len(paragraphs) <= 2 else [paragraphs[0], paragraphs[-1]]
+
+
+def _book_row(book_id, book):
+    """The books and descriptions table rows for a raw book (books.py format)"""
+    title = book['title']
+    category = book['category']
+    paragraphs = [paragraph.strip() for paragraph in _as_list(book['description']) if paragraph.strip()]
+    return (
+        (book_id, title, title.lower(), json.dumps(_as_list(book['authors'])), category, category.lower(),
+         json.dumps(_as_list(book['genres'])), book['pages'], book['copies'], book['available'], book['url'],
+         json.dumps(_preview(paragraphs))),
+        (book_id, json.dumps(paragraphs)),
+    )
+
+
+class MemoryRepository:
+    """Serves books from the in-process CatalogIndex"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    @property
+    def version(self):
+        return self.catalog.version
+
+    @property
+    def modified(self):
+        return self.catalog.modified
+
+    def rebuild(self):
+        self.catalog.rebuild()
+
+    def changed(self):
+        # books.py and snapshots only change with a restart
+        return False
+
+    def get(self, book_id):
+        try:
+            return self.catalog.get(int(book_id))
+        except ValueError:
+            return None
+
+    def get_many(self, book_ids):
+        """Look up several books at once, in the order given (None for unknown IDs)"""
+        return [self.get(book_id) for book_id in book_ids]
+
+    def records(self, descriptions=False):
+        """Every book in ID (catalog) order"""
+        return sorted(self.catalog.all(), key=lambda book: int(book['id']))
+
+    def title_order(self):
+        """Every book in title order, as a sequence (for the facet index)"""
+        return self.catalog.all()
+
+    def by_category(self, category=None):
+        if category and category.lower() != 'all':
+            return self.catalog.by_category(category)
+        return self.catalog.all()
+
+    def page(self, category=None, after=None, limit=None):
+        return self.catalog.page(category, after, limit)
+
+    def count(self, category=None):
+        return len(self.by_category(category))
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def set_available(self, book_id, available):
+        """Update the live copy count on the shared record"""
+        book = self.catalog.get(book_id)
+        if book is not None:
+            book.available = available
+
+
+class SnapshotOrder:
+    """Books of a snapshot in title order, decoded from the mapping when they are read"""
+
+    def __init__(self, repository, indexes):
+        self.repository = repository
+        self.indexes = indexes
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, position):
+        return self.repository._book(self.indexes[position])
+
+    def __iter__(self):
+        return (self.repository._book(index) for index in self.indexes)
+
+
+class SnapshotRepository:
+    """Serves books straight out of a memory-mapped catalog snapshot.
+
+    Records are decoded from the mapping when they are asked for and never
+    kept, and the title and category orders are arrays stored in the
+    snapshot, so the catalog itself takes no heap and no sorting at startup.
+    available overrides the stored copy counts as for SQLiteRepository.
+    """
+
+    def __init__(self, snapshot, available=None):
+        self.snapshot = snapshot
+        self.available = available
+        self.descriptions = snapshot.descriptions
+        self._version = 1
+        self._modified = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Counter bumped by rebuild()"""
+        return self._version
+
+    @property
+    def modified(self):
+        """Unix time of the last rebuild()"""
+        return self._modified
+
+    def rebuild(self):
+        """Mark the catalog as changed so caches and derived indexes are rebuilt"""
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+
+    def changed(self):
+        # A snapshot only changes with a restart
+        return False
+
+    def set_available(self, book_id, available):
+        """Nothing to do: records read their counts from available() when decoded"""
+
+    def _book(self, index, live=True):
+        book = self.snapshot.book(index)
+        if live and self.available is not None:
+            live_count = self.available(book.id)
+            if live_count is not None:
+                book.available = live_count
+        return book
+
+    def get(self, book_id):
+        try:
+            book_id = int(book_id)
+        except ValueError:
+            return None
+        if not 1 <= book_id <= len(self.snapshot):
+            return None
+        return self._book(book_id - 1)
+
+    def get_many(self, book_ids):
+        """Look up several books at once, in the order given (None for unknown IDs)"""
+        return [self.get(book_id) for book_id in book_ids]
+
+    def stored_counts(self, book_id):
+        """(copies, available) stored in the snapshot for a book, None if there is no such book"""
+        try:
+            book_id = int(book_id)
+        except ValueError:
+            return None
+        if not 1 <= book_id <= len(self.snapshot):
+            return None
+        return self.snapshot.copy_count(book_id - 1)
+
+    def records(self, descriptions=False):
+        """Every book in ID (catalog) order, with the copy counts stored in the snapshot"""
+        return (self._book(index, live=False) for index in range(len(self.snapshot)))
+
+    def title_order(self):
+        return SnapshotOrder(self, self.snapshot.order())
+
+    def by_category(self, category=None):
+        """Books in a category (or all books) in title order"""
+        if category and category.lower() != 'all':
+            return SnapshotOrder(self, self.snapshot.order(category.lower()))
+        return SnapshotOrder(self, self.snapshot.order())
+
+    def page(self, category=None, after=None, limit=None):
+        """Return (books, count, next_cursor) like CatalogIndex.page, bisecting the stored order"""
+        listing = self.by_category(category)
+        start = bisect_right(listing, after, key=sort_key) if after else 0
+        end = len(listing) if limit is None else min(start + limit, len(listing))
+        end = max(start, end)
+
+        next_cursor = None
+        if start < end < len(listing):
+            next_cursor = encode_cursor(sort_key(listing[end - 1]))
+
+        books = (listing[position] for position in range(start, end))
+        return books, end - start, next_cursor
+
+    def count(self, category=None):
+        return len(self.by_category(category))
+
+    def __len__(self):
+        return len(self.snapshot)
+
+
+class SQLiteDescriptions:
+    """Description text loaded from the database only when a page shows it (a DescriptionStore stand-in).
+
+    Handles are (book ID, preview column): previews come with the record,
+    so only the full text takes a query of its own.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def paragraphs(self, handle):
+        row = self.repository._connection().execute(
+            'SELECT paragraphs FROM descriptions WHERE book_id = ?', (handle[0],)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def first_and_last(self, handle):
+        if handle[1] is not None:
+            return json.loads(handle[1])
+        return _preview(self.paragraphs(handle))
+
+
+class _LoadedDescriptions:
+    """Stands in for a description store when the paragraphs were read along with the record"""
+
+    @staticmethod
+    def paragraphs(handle):
+        return handle
+
+    @staticmethod
+    def first_and_last(handle):
+        return _preview(handle)
+
+
+class TitleOrder:
+    """A SQLite catalog in title order, for the facet index.
+
+    Iterating streams every record once and remembers the IDs; indexing
+    afterwards (books[n]) fetches that one record by primary key, so only
+    the ID array stays in memory. Iterate before using len() or books[n].
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._ids = array('I')
+
+    def __iter__(self):
+        ids = self._ids = array('I')
+        for book in self.repository.by_category():
+            ids.append(int(book['id']))
+            yield book
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, position):
+        return self.repository.get(self._ids[position])
+
+    def fetch(self, positions):
+        """The books at several positions, in one query"""
+        return self.repository.get_many([self._ids[position] for position in positions])
+
+
+class SQLiteRepository:
+    """Serves books from a SQLite database through one connection per thread.
+
+    Listings walk the (category_key, title_key, id) and (title_key, id)
+    indexes in order and never touch the descriptions table. available is
+    an optional callable(book_id) returning live copy counts (from the
+    circulation engine) that override the counts stored at import time;
+    when it returns None the stored count is used. changed() reports
+    commits made by other processes, checked at most every check_interval
+    seconds.
+    """
+
+    def __init__(self, path, available=None, check_interval=5.0):
+        self.path = path
+        self.available = available
+        self.check_interval = check_interval
+        self.descriptions = SQLiteDescriptions(self)
+        self._version = 1
+        self._modified = time.time()
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        connection = self._connection()
+        with connection:
+            connection.executescript(SCHEMA)
+            if 'preview' not in {row[1] for row in connection.execute('PRAGMA table_info(books)')}:
+                self._add_previews(connection)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        # PRAGMA data_version only moves when *another* connection commits, so a
+        # connection of its own watches for writes from other threads and processes
+        self._monitor = sqlite3.connect(path, check_same_thread=False)
+        self._data_version = self._read_data_version()
+        self._checked = time.monotonic()
+
+    @staticmethod
+    def _add_previews(connection, batch_size=1000):
+        # Databases written before version 2 get their previews filled in from the descriptions
+        connection.execute('ALTER TABLE books ADD COLUMN preview TEXT')
+        cursor = connection.execute('SELECT book_id, paragraphs FROM descriptions')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            connection.executemany('UPDATE books SET preview = ? WHERE id = ?',
+                                   [(json.dumps(_preview(json.loads(paragraphs))), book_id)
+                                    for book_id, paragraphs in rows])
+
+    def _open(self):
+        # Handed over between threads once its first thread has exited
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets readers in other threads and processes carry on during an import
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('PRAGMA mmap_size = 268435456')
+        return connection
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            with self._lock:
+                # Connections of threads that have exited are reused or closed, so a
+                # thread-per-request server never has more connections than live threads
+                idle = [owned for thread, owned in self._connections if not thread.is_alive()]
+                connection = idle.pop() if idle else self._open()
+                for owned in idle:
+                    owned.close()
+                self._connections = [(thread, owned) for thread, owned in self._connections
+                                     if thread.is_alive()]
+                self._connections.append((threading.current_thread(), connection))
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close every thread's connection"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for _, connection in connections:
+            connection.close()
+        self._monitor.close()
+        self._local = threading.local()
+
+    @property
+    def version(self):
+        """Counter bumped by rebuild()"""
+        return self._version
+
+    @property
+    def modified(self):
+        """Unix time of the last rebuild()"""
+        return self._modified
+
+    def _read_data_version(self):
+        return self._monitor.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed(self):
+        """True (once per change) if the database was written since the last check or rebuild()"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            data_version = self._read_data_version()
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            return True
+
+    def rebuild(self, catch_up=True):
+        """Mark the catalog as changed so caches and derived indexes are rebuilt.
+
+        With catch_up every write made so far counts as handled; without it
+        only those changed() has already reported do, so writes that came in
+        while derived indexes were being rebuilt are reported again.
+        """
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+            if catch_up:
+                self._data_version = self._read_data_version()
+
+    def set_available(self, book_id, available):
+        """Nothing to do: records read their counts from available() when fetched"""
+
+    def _book(self, row, live=True, paragraphs=None):
+        book_id, title, authors, category, genres, pages, copies, available, cover_image, preview = row
+        if live and self.available is not None:
+            live_count = self.available(str(book_id))
+            if live_count is not None:
+                available = live_count
+        if paragraphs is not None:
+            descriptions, description = _LoadedDescriptions, paragraphs
+        else:
+            descriptions, description = self.descriptions, (book_id, preview)
+        return Book(
+            id=str(book_id),
+            title=title,
+            author_list=json.loads(authors),
+            category=category,
+            genre_list=json.loads(genres),
+            pages=pages,
+            copies=copies,
+            available=available,
+            cover_image=cover_image,
+            descriptions=descriptions,
+            description=description,
+        )
+
+    def _books(self, cursor):
+        return (self._book(row) for row in cursor)
+
+    def get(self, book_id):
+        try:
+            book_id = int(book_id)
+        except ValueError:
+            return None
+        row = self._connection().execute(f'SELECT {BOOK_COLUMNS} FROM books WHERE id = ?', (book_id,)).fetchone()
+        return self._book(row) if row else None
+
+    def get_many(self, book_ids):
+        """Look up several books at once, in the order given (None for unknown IDs)"""
+        wanted = []
+        for book_id in book_ids:
+            try:
+                wanted.append(int(book_id))
+            except ValueError:
+                wanted.append(None)
+        ids = sorted({book_id for book_id in wanted if book_id is not None})
+        found = {}
+        for start in range(0, len(ids), MAX_BOUND_IDS):
+            chunk = ids[start:start + MAX_BOUND_IDS]
+            cursor = self._connection().execute(
+                f'SELECT {BOOK_COLUMNS} FROM books WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+            found.update((row[0], row) for row in cursor)
+        return [self._book(found[book_id]) if book_id in found else None for book_id in wanted]
+
+    def records(self, descriptions=False):
+        """Every book in ID (catalog) order, with the copy counts stored in the database.
+
+        With descriptions=True the text comes from the same streaming query
+        (for building the search index) instead of one lookup per book.
+        """
+        if not descriptions:
+            cursor = self._connection().execute(f'SELECT {BOOK_COLUMNS} FROM books ORDER BY id')
+            return (self._book(row, live=False) for row in cursor)
+        cursor = self._connection().execute(
+            f'SELECT {BOOK_COLUMNS}, paragraphs FROM books '
+            'LEFT JOIN descriptions ON descriptions.book_id = books.id ORDER BY id')
+        return (self._book(row[:-1], live=False, paragraphs=json.loads(row[-1] or '[]')) for row in cursor)
+
+    def title_order(self):
+        return TitleOrder(self)
+
+    def by_category(self, category=None):
+        """Books in a category (or all books), lazily in title order"""
+        if category and category.lower() != 'all':
+            return self._books(self._connection().execute(
+                f'SELECT {BOOK_COLUMNS} FROM books WHERE category_key = ? ORDER BY title_key, id',
+                (category.lower(),)))
+        return self._books(self._connection().execute(
+            f'SELECT {BOOK_COLUMNS} FROM books ORDER BY title_key, id'))
+
+    def page(self, category=None, after=None, limit=None):
+        """Return (books, count, next_cursor) like CatalogIndex.page, as an index range scan"""
+        where, params = [], []
+        if category and category.lower() != 'all':
+            where.append('category_key = ?')
+            params.append(category.lower())
+        if after:
+            where.append('(title_key, id) > (?, ?)')
+            params.extend(after)
+        condition = ' WHERE ' + ' AND '.join(where) if where else ''
+        sql = f'SELECT {BOOK_COLUMNS} FROM books{condition} ORDER BY title_key, id'
+
+        if limit is None:
+            # Runs to the end of the listing; rows are streamed straight from the cursor
+            count = self._connection().execute(f'SELECT COUNT(*) FROM books{condition}', params).fetchone()[0]
+            return self._books(self._connection().execute(sql, params)), count, None
+
+        # One extra row tells us whether there is a next page
+        books = [self._book(row) for row in self._connection().execute(sql + ' LIMIT ?', params + [limit + 1])]
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = encode_cursor(sort_key(books[-1]))
+        return iter(books), len(books), next_cursor
+
+    def count(self, category=None):
+        if category and category.lower() != 'all':
+            row = self._connection().execute(
+                'SELECT COUNT(*) FROM books WHERE category_key = ?', (category.lower(),)).fetchone()
+        else:
+            row = self._connection().execute('SELECT COUNT(*) FROM books').fetchone()
+        return row[0]
+
+    def __len__(self):
+        return self.count()
+
+    def import_books(self, books, batch_size=1000):
+        """Replace the catalog with raw books (books.py format), numbered from 1 in order.
+
+        Rows are inserted batch_size at a time inside a single transaction, so
+        readers see either the old catalog or the new one.
+        """
+        connection = self._connection()
+        books = iter(books)
+        count = 0
+        with connection:
+            connection.execute('DELETE FROM descriptions')
+            connection.execute('DELETE FROM books')
+            while True:
+                batch = [_book_row(count + offset + 1, book) for offset, book in enumerate(islice(books, batch_size))]
+                if not batch:
+                    break
+                connection.executemany('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                       [book_row for book_row, _ in batch])
+                connection.executemany('INSERT INTO descriptions VALUES (?, ?)',
+                                       [description_row for _, description_row in batch])
+                count += len(batch)
+        connection.execute('ANALYZE')
+        return count
+
+    def add(self, book):
+        """Append a raw book and return its new ID"""
+        book_row, description_row = _book_row(None, book)
+        connection = self._connection()
+        with connection:
+            # SQLite assigns the ID under the write lock, so concurrent writers never collide
+            book_id = connection.execute('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', book_row).lastrowid
+            connection.execute('INSERT INTO descriptions VALUES (?, ?)', (book_id,) + description_row[1:])
+        return str(book_id)
+
+    def replace(self, book_id, book):
+        """Overwrite an existing book with a raw book"""
+        book_row, description_row = _book_row(int(book_id), book)
+        connection = self._connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', book_row)
+            connection.execute('INSERT OR REPLACE INTO descriptions VALUES (?, ?)', description_row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the SQLite catalog database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_command = commands.add_parser('import', help="replace the database's catalog with a catalog source")
+    import_command.add_argument('source', help="books.py, or a .jsonl/.csv file in the same format")
+    import_command.add_argument('database', help="SQLite database file (created if missing)")
+    import_command.add_argument('--batch-size', type=int, default=1000)
+
+    args = parser.parse_args(argv)
+
+    repository = SQLiteRepository(args.database)
+    count = repository.import_books(read_source(args.source), args.batch_size)
+    repository.close()
+    print(f"Imported {count} books into {args.database} ({os.path.getsize(args.database):,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
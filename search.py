@@ -0,0 +1,284 @@
+import heapq
+import math
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Matches in a title count for more than matches in the description
+FIELD_WEIGHTS = {
+    'title': 3,
+    'author': 2,
+    'genres': 2,
+    'description': 1,
+}
+
+
+def tokenize(text):
+    """Split text into lower-cased word tokens"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _term_counts(fields):
+    """Weighted term frequencies of a document's fields"""
+    counts = Counter()
+    for name, text in fields.items():
+        weight = FIELD_WEIGHTS.get(name, 1)
+        if weight == 1:
+            counts.update(tokenize(text))
+        else:
+            for token, count in Counter(tokenize(text)).items():
+                counts[token] += count * weight
+    return counts
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # Best completions below this node, or None when they need recomputing
+        self.top = []
+
+
+class SearchIndex:
+    """Tokenised inverted index with BM25 ranking and a prefix trie for typeahead.
+
+    Each term maps to a sorted array of integer document IDs and a parallel
+    array of (weighted) term frequencies. Every trie node caches its best
+    completions, so a suggestion lookup only walks the characters of the
+    prefix. A whole catalog is indexed with build(); documents can then be
+    added, replaced or removed one at a time.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, suggestions=8):
+        self.k1 = k1
+        self.b = b
+        self.suggestions = suggestions
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._freqs = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._trie = _TrieNode()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_lengths
+
+    # Indexing
+
+    def add(self, doc_id, fields):
+        """Index a document; fields maps a field name (see FIELD_WEIGHTS) to its text"""
+        counts = _term_counts(fields)
+
+        with self._lock:
+            if doc_id in self._doc_lengths:
+                self._remove(doc_id)
+
+            terms = []
+            for term, count in counts.items():
+                # Interned, so every document's term list shares one copy of each string
+                term = sys.intern(term)
+                terms.append(term)
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array('I')
+                    self._freqs[term] = array('H')
+                position = bisect_left(postings, doc_id)
+                postings.insert(position, doc_id)
+                self._freqs[term].insert(position, min(count, 0xFFFF))
+                self._promote(term)
+
+            length = sum(counts.values())
+            self._doc_terms[doc_id] = tuple(terms)
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+    update = add
+
+    @classmethod
+    def build(cls, documents, **options):
+        """Index a whole collection of (doc_id, fields) pairs at once.
+
+        Much faster than calling add() per document: postings are collected
+        in plain lists, sorted by ID once and converted to arrays, and the
+        trie's cached completions are filled in a single pass at the end.
+        """
+        index = cls(**options)
+        # term -> ([doc_id, ...], [frequency, ...])
+        collected = {}
+        in_order = True
+        last_id = -1
+
+        for doc_id, fields in documents:
+            if doc_id in index._doc_lengths:
+                raise ValueError(f"document {doc_id} is indexed twice")
+            in_order = in_order and doc_id > last_id
+            last_id = doc_id
+
+            counts = _term_counts(fields)
+            terms = []
+            for term, count in counts.items():
+                term = sys.intern(term)
+                terms.append(term)
+                entry = collected.get(term)
+                if entry is None:
+                    entry = collected[term] = ([], [])
+                entry[0].append(doc_id)
+                entry[1].append(count if count < 0xFFFF else 0xFFFF)
+
+            length = sum(counts.values())
+            index._doc_terms[doc_id] = tuple(terms)
+            index._doc_lengths[doc_id] = length
+            index._total_length += length
+
+        for term, (postings, term_freqs) in collected.items():
+            if not in_order:
+                pairs = sorted(zip(postings, term_freqs))
+                postings = [doc_id for doc_id, _ in pairs]
+                term_freqs = [freq for _, freq in pairs]
+            index._postings[term] = array('I', postings)
+            index._freqs[term] = array('H', term_freqs)
+
+            node = index._trie
+            for char in term:
+                node = node.children.setdefault(char, _TrieNode())
+
+        index._fill_trie()
+        return index
+
+    def remove(self, doc_id):
+        """Drop a document from the index (no-op if it is not indexed)"""
+        with self._lock:
+            if doc_id in self._doc_lengths:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            position = bisect_left(postings, doc_id)
+            del postings[position]
+            del self._freqs[term][position]
+            if not postings:
+                del self._postings[term]
+                del self._freqs[term]
+            self._demote(term)
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    # Ranking
+
+    def search(self, query, limit=None):
+        """Return [(doc_id, score), ...] for documents matching any query term, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            total_docs = len(self._doc_lengths)
+            if not terms or not total_docs:
+                return []
+
+            k1 = self.k1
+            average_length = self._total_length / total_docs
+            doc_lengths = self._doc_lengths
+            scores = {}
+
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in zip(postings, self._freqs[term]):
+                    norm = k1 * (1 - self.b + self.b * doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (k1 + 1) / (freq + norm)
+
+        # Ties are broken by document ID so the order is stable between requests
+        key = lambda item: (item[1], -item[0])
+        if limit is None:
+            return sorted(scores.items(), key=key, reverse=True)
+        return heapq.nlargest(limit, scores.items(), key=key)
+
+    # Typeahead
+
+    def suggest(self, prefix, limit=None):
+        """Complete the last word of prefix with the most common indexed terms"""
+        tokens = tokenize(prefix)
+        if not tokens:
+            return []
+        head, last = tokens[:-1], tokens[-1]
+        limit = min(limit or self.suggestions, self.suggestions)
+
+        with self._lock:
+            node = self._trie
+            for char in last:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            if node.top is None:
+                node.top = self._best_below(node, last)
+            completions = node.top[:limit]
+
+        lead = ' '.join(head)
+        return [f'{lead} {term}' if lead else term for term in completions]
+
+    def _rank(self, term):
+        return (-len(self._postings.get(term, ())), term)
+
+    def _promote(self, term):
+        # Called after term gained a document: push it into the cached lists on its path
+        node = self._trie
+        for char in term:
+            node = node.children.setdefault(char, _TrieNode())
+            top = node.top
+            if top is None:
+                continue
+            if term not in top:
+                if len(top) >= self.suggestions and self._rank(term) >= self._rank(top[-1]):
+                    continue
+                top.append(term)
+            top.sort(key=self._rank)
+            del top[self.suggestions:]
+
+    def _demote(self, term):
+        # Called after term lost a document: cached lists that held it may now be wrong
+        node = self._trie
+        for char in term:
+            node = node.children.get(char)
+            if node is None:
+                return
+            if node.top is not None and term in node.top:
+                node.top = None
+
+    def _fill_trie(self):
+        # Post-order walk: a node's best completions are the best of its own
+        # term and of its children's already computed lists
+        rank = self._rank
+        stack = [(self._trie, '', False)]
+        while stack:
+            node, path, done = stack.pop()
+            if not done:
+                stack.append((node, path, True))
+                stack.extend((child, path + char, False) for char, child in node.children.items())
+                continue
+            candidates = [path] if path in self._postings else []
+            for child in node.children.values():
+                candidates.extend(child.top)
+            node.top = heapq.nsmallest(self.suggestions, candidates, key=rank)
+
+    def _best_below(self, node, prefix):
+        best = []
+        stack = [(node, prefix)]
+        while stack:
+            current, path = stack.pop()
+            if path in self._postings:
+                best.append(self._rank(path))
+            for char, child in current.children.items():
+                stack.append((child, path + char))
+        return [term for _, term in heapq.nsmallest(self.suggestions, best)]
@@ -0,0 +1,291 @@
+"""Binary catalog snapshots.
+
+Compiles the catalog (books.py, or a JSONL/CSV file in the same format)
+into a single versioned file that the app memory-maps at startup instead
+of importing books.py:
+
+    python snapshot.py build books.py catalog.snap
+    python snapshot.py verify catalog.snap
+
+Layout (all integers little-endian):
+
+    header       fixed size, see HEADER
+    records      one RECORD per book, in catalog order
+    strings      string count + 1 uint64 offsets into the pool
+    pool         deduplicated UTF-8 strings
+    lists        uint32 words; a list is its length followed by string indexes
+    order        uint32 record indexes of the whole catalog in title order
+    categories   uint32 words: the category count, then per category the string
+                 index of its lower-cased name, its length and its record
+                 indexes in title order
+    descriptions a DescriptionStore (see records.py)
+
+The CRC32 in the header covers everything after the header.
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import runpy
+import struct
+import sys
+import zlib
+from array import array
+
+from records import Book, DescriptionStore
+
+MAGIC = b'SGSNAP\0\0'
+FORMAT_VERSION = 2
+
+# magic, format version, record count, string count, crc32,
+# then the offsets of the records, strings, pool, lists, order, categories and
+# descriptions sections and the file size
+HEADER = struct.Struct('<8sIIII8Q')
+
+# title, category, url, authors list, genres list, pages, copies, available, description handle
+RECORD = struct.Struct('<IIIIIiiiI')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def read_source(path):
+    """Read raw books (the books.py dict format) from a .py, .jsonl or .csv file"""
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.py':
+        return runpy.run_path(path)['all_books']
+
+    if extension == '.jsonl':
+        with open(path, encoding='utf-8') as stream:
+            return [json.loads(line) for line in stream if line.strip()]
+
+    if extension == '.csv':
+        # List columns are '|' separated; description paragraphs are separated by blank lines
+        books = []
+        with open(path, encoding='utf-8', newline='') as stream:
+            for row in csv.DictReader(stream):
+                books.append({
+                    'title': row['title'],
+                    'category': row['category'],
+                    'url': row['url'],
+                    'authors': [author.strip() for author in row['authors'].split('|') if author.strip()],
+                    'genres': [genre.strip() for genre in row['genres'].split('|') if genre.strip()],
+                    'description': [paragraph for paragraph in row['description'].split('\n\n') if paragraph.strip()],
+                    'pages': int(row['pages']),
+                    'available': int(row['available']),
+                    'copies': int(row['copies']),
+                })
+        return books
+
+    raise SnapshotError(f"unsupported catalog source: {path}")
+
+
+def _align(stream):
+    # Keep every section 8-byte aligned so offset arrays can be cast in place
+    padding = -stream.tell() % 8
+    stream.write(b'\0' * padding)
+    return stream.tell()
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def build(books, path):
+    """Write books (the books.py dict format) to a snapshot at path"""
+    strings = {}
+    lists = array('I')
+    records = bytearray()
+    descriptions = DescriptionStore()
+    titles = []
+    categories = []
+
+    def string(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    def string_list(values):
+        start = len(lists)
+        lists.append(len(values))
+        lists.extend(string(value) for value in values)
+        return start
+
+    for book in books:
+        titles.append(book['title'].lower())
+        categories.append(book['category'].lower())
+        records += RECORD.pack(
+            string(book['title']),
+            string(book['category']),
+            string(book['url']),
+            string_list(_as_list(book['authors'])),
+            string_list(_as_list(book['genres'])),
+            book['pages'],
+            book['copies'],
+            book['available'],
+            descriptions.add(book['description']),
+        )
+
+    # Title order by the same (title, ID) key as catalog.sort_key, so listings are slices of it
+    order = array('I', sorted(range(len(titles)), key=lambda index: (titles[index], index + 1)))
+    by_category = {}
+    for index in order:
+        by_category.setdefault(categories[index], []).append(index)
+    category_words = array('I', [len(by_category)])
+    for category, indexes in by_category.items():
+        category_words.extend((string(category), len(indexes)))
+        category_words.extend(indexes)
+
+    pool = bytearray()
+    offsets = array('Q', [0])
+    for value in strings:
+        pool += value.encode('utf-8')
+        offsets.append(len(pool))
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w+b') as stream:
+        stream.write(b'\0' * HEADER.size)
+        sections = []
+        for section in (records, offsets.tobytes(), pool, lists.tobytes(), order.tobytes(), category_words.tobytes()):
+            sections.append(_align(stream))
+            stream.write(section)
+        sections.append(_align(stream))
+        descriptions.write(stream)
+        size = stream.tell()
+
+        stream.seek(HEADER.size)
+        checksum = 0
+        while True:
+            chunk = stream.read(1 << 20)
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+
+        stream.seek(0)
+        stream.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(titles), len(strings), checksum, *sections, size))
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary, path)
+
+
+class Snapshot:
+    """A memory-mapped catalog snapshot.
+
+    Nothing is decoded up front: records and strings are read straight out of
+    the mapping, and the description text and the title and category
+    orders stay there for good, so every worker shares the same physical
+    pages through the OS page cache.
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        with open(path, 'rb') as stream:
+            self._mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        if len(view) < HEADER.size:
+            raise SnapshotError(f"{path}: truncated header")
+        (magic, version, self.count, string_count, self.checksum,
+         records, strings, pool, lists, order, categories, descriptions, size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path}: not a catalog snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"{path}: unsupported snapshot version {version}; rebuild it with snapshot.py build")
+        if size != len(view):
+            raise SnapshotError(f"{path}: expected {size} bytes, found {len(view)}")
+        if verify and zlib.crc32(view[HEADER.size:]) != self.checksum:
+            raise SnapshotError(f"{path}: checksum mismatch")
+
+        self._records = view[records:records + self.count * RECORD.size]
+        self._offsets = view[strings:strings + (string_count + 1) * 8].cast('Q')
+        self._pool = view[pool:pool + self._offsets[string_count]]
+        self._lists = view[lists:lists + (order - lists) // 4 * 4].cast('I')
+        self._order = view[order:order + self.count * 4].cast('I')
+        self.descriptions = DescriptionStore.from_buffer(view[descriptions:])
+        self._strings = {}
+
+        # Lower-cased category -> its slice of record indexes, still in the mapping
+        self._categories = {}
+        words = view[categories:categories + (descriptions - categories) // 4 * 4].cast('I')
+        position = 1
+        for _ in range(words[0]):
+            name, length = words[position], words[position + 1]
+            self._categories[self.string(name)] = words[position + 2:position + 2 + length]
+            position += 2 + length
+
+    def __len__(self):
+        return self.count
+
+    def string(self, index):
+        """Decode one pooled string (decoded strings are cached and interned)"""
+        value = self._strings.get(index)
+        if value is None:
+            value = str(self._pool[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+            value = self._strings[index] = sys.intern(value)
+        return value
+
+    def _string_list(self, start):
+        lists = self._lists
+        return [self.string(lists[index]) for index in range(start + 1, start + 1 + lists[start])]
+
+    def book(self, index):
+        """Build the processed Book record for the book at a 0-based catalog index"""
+        (title, category, url, authors, genres,
+         pages, copies, available, description) = RECORD.unpack_from(self._records, index * RECORD.size)
+        return Book(
+            id=str(index + 1),
+            title=str(self._pool[self._offsets[title]:self._offsets[title + 1]], 'utf-8'),
+            author_list=self._string_list(authors),
+            category=self.string(category),
+            genre_list=self._string_list(genres),
+            pages=pages,
+            copies=copies,
+            available=available,
+            cover_image=str(self._pool[self._offsets[url]:self._offsets[url + 1]], 'utf-8'),
+            descriptions=self.descriptions,
+            description=description,
+        )
+
+    def order(self, category=None):
+        """0-based indexes of the books (of one lower-cased category) in title order"""
+        if category is None:
+            return self._order
+        return self._categories.get(category, ())
+
+    def copy_count(self, index):
+        """(copies, available) of the book at a 0-based catalog index"""
+        record = RECORD.unpack_from(self._records, index * RECORD.size)
+        return record[6], record[7]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and check binary catalog snapshots")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_command = commands.add_parser('build', help="compile a catalog source into a snapshot")
+    build_command.add_argument('source', help="books.py, or a .jsonl/.csv file in the same format")
+    build_command.add_argument('output', help="snapshot file to write")
+
+    verify_command = commands.add_parser('verify', help="check a snapshot's header and checksum")
+    verify_command.add_argument('path')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        books = read_source(args.source)
+        build(books, args.output)
+        print(f"Wrote {len(books)} books to {args.output} ({os.path.getsize(args.output):,} bytes)")
+    else:
+        try:
+            snapshot = Snapshot(args.path, verify=True)
+        except SnapshotError as error:
+            parser.exit(1, f"{error}\n")
+        print(f"{args.path}: {len(snapshot)} books, checksum {snapshot.checksum:08x} OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+from werkzeug.test import Client
+
+# The application modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def client():
+    """WSGI test client for the app serving the bundled books.py catalog"""
+    # werkzeug's own client: Flask's needs werkzeug.__version__, which Werkzeug 3 dropped
+    import app
+    return Client(app.app)
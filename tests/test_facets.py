@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+import facets
+from catalog import sort_key
+from facets import FacetIndex
+
+
+class FakeBook(dict):
+    """The fields of a processed record FacetIndex reads"""
+
+
+def make_books():
+    # Many adult authors with a few books each and a handful of teen authors
+    # with fewer, so no teen author is among the most common overall
+    books = []
+    for number in range(1, 1101):
+        if number <= 1040:
+            category, authors = 'Adult', [f'Adult Author {number % 52}']
+        else:
+            category, authors = 'Teens', [f'Teen Author {number % 6}']
+        if number == 1100:
+            authors.append('Seldom Seen')
+        books.append(FakeBook(id=str(number), title=f'Title {number:04}', category=category,
+                              genre_list=['Fantasy'] if number % 3 else ['Fantasy', 'Horror'],
+                              author_list=authors, pages=number % 700, available=number % 4))
+    books.sort(key=sort_key)
+    return books
+
+
+@pytest.fixture
+def index():
+    return FacetIndex(make_books())
+
+
+def ids(index, mask):
+    books, _, _ = index.page(mask)
+    return [book['id'] for book in books]
+
+
+def test_values_of_a_field_are_or_ed_and_fields_and_ed(index):
+    either = index.select({'genre': ['Horror', 'Fantasy'], 'category': ['teens']})
+    both = index.select({'genre': ['Horror', 'Fantasy'], 'category': ['teens']}, match_all=('genre',))
+    assert ids(index, either) == [str(number) for number in range(1041, 1101)]
+    assert ids(index, both) == [str(number) for number in range(1041, 1101) if number % 3 == 0]
+    assert index.select({'genre': []}) is None
+    assert ids(index, index.select({}, within=index.mask_of(['7', '3', 'missing']))) == ['3', '7']
+
+
+def test_counts_find_values_that_are_rare_overall(index):
+    # One book matched, by an author far outside the most common ones
+    counts = index.counts({}, within=index.mask_of(['1100']))
+    assert [(value, count) for value, _, count in counts['author']] == [('Seldom Seen', 1), ('Teen Author 2', 1)]
+
+    counts = index.counts({'category': ['teens']})
+    assert [(value, count) for value, _, count in counts['author']] == [
+        (f'Teen Author {number}', 10) for number in range(6)] + [('Seldom Seen', 1)]
+    assert ('teens', 'Teens', 60) in counts['category'] and ('adult', 'Adult', 1040) in counts['category']
+
+
+def test_counts_of_a_large_selection_come_from_its_own_books(index, monkeypatch):
+    # Too many books to tally them all: the values to count are picked from a sample
+    monkeypatch.setattr(facets, 'FACET_TALLY_LIMIT', 20)
+    counts = index.counts({'category': ['teens']})
+    shown = {value: count for value, _, count in counts['author']}
+    assert shown.items() >= {f'Teen Author {number}': 10 for number in range(6)}.items()
+
+
+def test_counts_with_nothing_selected_rank_by_overall_popularity(index):
+    counts = index.counts({})
+    assert len(counts['author']) == 10
+    assert all(count == 20 for _, _, count in counts['author'])
+    assert counts['genre'] == [('Fantasy', 'Fantasy', 1100), ('Horror', 'Horror', 366)]
+
+
+def test_set_member_updates_are_not_lost(index):
+    ids_in_catalog = [str(number) for number in range(1, 1101)]
+    for book_id in ids_in_catalog:
+        index.set_member('available', 'available', book_id, False)
+
+    # Concurrent read-modify-writes of the same bitset must all land
+    threads = [threading.Thread(target=lambda part=part: [
+        index.set_member('available', 'available', book_id, True) for book_id in ids_in_catalog[part::8]])
+        for part in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(index.has('available', 'available', book_id) for book_id in ids_in_catalog)
+    assert index.select({'available': ['available']}).bit_count() == 1100
+
+    index.set_member('available', 'available', '5', False)
+    assert not index.has('available', 'available', '5')
+    assert '5' not in ids(index, index.select({'available': ['available']}))
+
+
+def test_page_walks_a_filtered_listing(index):
+    mask = index.select({'category': ['teens']})
+    books, count, next_cursor = index.page(mask, limit=25)
+    assert count == 25 and [book['id'] for book in books][0] == '1041'
+    rest, count, _ = index.page(mask, after=sort_key(index.books[1065 - 1]))
+    assert count == 35
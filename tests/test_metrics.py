@@ -0,0 +1,73 @@
+import threading
+
+from metrics import Registry
+
+
+def test_render_in_the_prometheus_text_format():
+    registry = Registry()
+    latency = registry.histogram('demo_seconds', "Demo latency.", ('route',), buckets=(0.1, 1.0))
+    responses = registry.counter('demo_total', "Demo responses.", ('route', 'status'))
+    registry.derived('demo_books', "Demo gauge.", lambda: 7)
+
+    latency.observe(0.05, 'home')
+    latency.observe(0.5, 'home')
+    latency.observe(3.0, 'home')
+    responses.inc('say "hi"\n', '200', amount=2)
+
+    assert registry.render().splitlines() == [
+        '# HELP demo_seconds Demo latency.',
+        '# TYPE demo_seconds histogram',
+        'demo_seconds_bucket{route="home",le="0.1"} 1',
+        'demo_seconds_bucket{route="home",le="1.0"} 2',
+        'demo_seconds_bucket{route="home",le="+Inf"} 3',
+        'demo_seconds_sum{route="home"} 3.55',
+        'demo_seconds_count{route="home"} 3',
+        '# HELP demo_total Demo responses.',
+        '# TYPE demo_total counter',
+        'demo_total{route="say \\"hi\\"\\n",status="200"} 2',
+        '# HELP demo_books Demo gauge.',
+        '# TYPE demo_books gauge',
+        'demo_books 7',
+    ]
+
+
+def test_short_lived_threads_do_not_pile_up_shards():
+    registry = Registry()
+    requests = registry.counter('demo_requests_total', "Demo requests.")
+
+    # A thread per request, as with werkzeug's threaded server
+    for _ in range(200):
+        thread = threading.Thread(target=requests.inc)
+        thread.start()
+        thread.join()
+
+    assert len(registry._shards) == 1
+    assert 'demo_requests_total 200' in registry.render()
+
+
+def test_concurrent_threads_are_all_counted():
+    registry = Registry()
+    requests = registry.counter('demo_requests_total', "Demo requests.")
+    start = threading.Barrier(8)
+
+    def serve():
+        start.wait()
+        for _ in range(1000):
+            requests.inc()
+
+    threads = [threading.Thread(target=serve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'demo_requests_total 8000' in registry.render()
+
+
+def test_metrics_endpoint_counts_requests_by_route(client):
+    client.get('/api/books/1')
+    client.get('/api/books/1')
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'library_responses_total{route="api_book",status="200"}' in body
+    assert 'library_request_phase_seconds_count{route="api_book",phase="handler"}' in body
+    assert 'library_page_cache_hits_total' in body
@@ -0,0 +1,79 @@
+import time
+
+from werkzeug.http import http_date
+
+from page_cache import CachedPage, PageCache
+
+
+def test_etag_answers_304_until_the_page_changes(client):
+    first = client.get('/book-details/5')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = client.get('/book-details/5', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+
+    # A checkout changes the page, so the old ETag no longer matches
+    assert client.post('/api/books/5/checkout').status_code == 200
+    try:
+        changed = client.get('/book-details/5', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+    finally:
+        client.post('/api/books/5/return')
+
+
+def test_gzip_is_a_separate_representation(client):
+    plain = client.get('/api/books?limit=10')
+    gzipped = client.get('/api/books?limit=10', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+    assert gzipped.headers['ETag'] != plain.headers['ETag']
+
+    # Each ETag only validates its own encoding
+    assert client.get('/api/books?limit=10', headers={'If-None-Match': plain.headers['ETag']}).status_code == 304
+    assert client.get('/api/books?limit=10', headers={
+        'If-None-Match': plain.headers['ETag'], 'Accept-Encoding': 'gzip'}).status_code == 200
+
+
+def test_if_modified_since_is_not_fooled_by_a_checkout_in_the_same_second(client):
+    # A stale copy dated the second of the checkout must not get a 304
+    client.get('/api/books/6')
+    assert client.post('/api/books/6/checkout').status_code == 200
+    try:
+        response = client.get('/api/books/6', headers={'If-Modified-Since': http_date(time.time())})
+        assert response.status_code == 200
+        assert response.json['available'] == response.json['copies'] - 1
+    finally:
+        client.post('/api/books/6/return')
+
+
+def test_if_modified_since_answers_304_for_an_unchanged_page(client):
+    # Pages rendered in the same second as a change carry no date, so start a second clear of any
+    time.sleep(1.1)
+    first = client.get('/book-titles?limit=7')
+    again = client.get('/book-titles?limit=7', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 304
+
+
+def test_a_discard_only_refuses_pages_carrying_its_tags():
+    cache = PageCache()
+    cache.get('warm-up', 1)
+    rendered = time.time()
+    # A book checked out while two pages were being rendered
+    cache.discard(('book', '2'))
+
+    def page(book_id):
+        return CachedPage(b'<html></html>', 'text/html', rendered, 0.0, 1, tags=frozenset({('book', book_id)}))
+
+    cache.put('book-1', page('1'))
+    cache.put('book-2', page('2'))
+    assert cache.get('book-1', 1) is not None
+    assert cache.get('book-2', 1) is None
+
+    assert cache.changed({('book', '1')}) == 0.0
+    assert cache.changed({('book', '1'), ('book', '2')}) >= rendered
+    cache.discard(('book', '1'))
+    assert cache.get('book-1', 1) is None
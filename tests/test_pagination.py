@@ -0,0 +1,85 @@
+from catalog import CatalogIndex, decode_cursor, encode_cursor, sort_key
+from repository import SnapshotRepository
+from snapshot import Snapshot, build
+
+
+def make_books():
+    # Repeated titles, so pages have to be told apart by ID as well
+    titles = ['Dune', 'emma', 'Dune', 'Beloved', 'dune', 'Atonement', 'Emma', 'Carrie']
+    return [{'id': str(book_id), 'title': title, 'category': 'Adult' if book_id % 2 else 'Teens'}
+            for book_id, title in enumerate(titles, start=1)]
+
+
+def walk(index, category=None, limit=3):
+    seen = []
+    after = None
+    while True:
+        books, count, next_cursor = index.page(category, after=after, limit=limit)
+        books = list(books)
+        assert len(books) == count
+        seen.extend(book['id'] for book in books)
+        if next_cursor is None:
+            return seen
+        after = decode_cursor(next_cursor)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(('dune', 3))) == ('dune', 3)
+    assert decode_cursor('') is None
+    assert decode_cursor('not a cursor') is None
+
+
+def test_pages_cover_the_listing_once_in_title_order():
+    books = make_books()
+    index = CatalogIndex(lambda: books)
+    expected = [book['id'] for book in sorted(books, key=sort_key)]
+    for limit in (1, 2, 3, len(books), len(books) + 5):
+        assert walk(index, limit=limit) == expected
+
+
+def test_category_pages():
+    books = make_books()
+    index = CatalogIndex(lambda: books)
+    expected = [book['id'] for book in sorted(books, key=sort_key) if book['category'] == 'Teens']
+    assert walk(index, category='teens', limit=2) == expected
+
+
+def test_cursor_survives_a_new_book_before_it():
+    books = make_books()
+    index = CatalogIndex(lambda: books)
+    first, _, next_cursor = index.page(limit=3)
+    first = [book['id'] for book in first]
+
+    # A title sorting before the cursor must not shift the next page
+    books.append({'id': '9', 'title': 'Aardvark', 'category': 'Adult'})
+    index.rebuild()
+    rest, _, _ = index.page(after=decode_cursor(next_cursor))
+    assert first + [book['id'] for book in rest] == [
+        book['id'] for book in sorted(books, key=sort_key) if book['id'] != '9']
+
+
+def test_snapshot_pages_match_the_catalog_index(tmp_path):
+    books = make_books()
+    raw = [dict(book, url='', authors=['Anon'], genres=[], description=[], pages=100, copies=1, available=1)
+           for book in books]
+    build(raw, tmp_path / 'catalog.snap')
+    repository = SnapshotRepository(Snapshot(tmp_path / 'catalog.snap'))
+    index = CatalogIndex(lambda: books)
+
+    for category in (None, 'teens', 'ADULT', 'missing'):
+        for limit in (1, 3, None):
+            assert walk(repository, category, limit) == walk(index, category, limit)
+    assert repository.get('3')['title'] == 'Dune'
+    assert repository.get('0') is None and repository.get('9') is None
+
+
+def test_api_listing_follows_next_cursors(client):
+    everything = client.get('/api/books?limit=500&fields=id').json['books']
+    seen = []
+    url = '/api/books?limit=3&fields=id'
+    while url:
+        page = client.get(url).json
+        assert page['total'] == len(everything)
+        seen.extend(page['books'])
+        url = f"/api/books?limit=3&fields=id&after={page['next']}" if page['next'] else None
+    assert seen == everything
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from records import NO_DESCRIPTION, Book, DescriptionStore
+
+DESCRIPTIONS = [
+    ['First paragraph.', 'Middle one.', '  ', 'Last paragraph.'],
+    'A single string, with ünïcödé.',
+    [],
+    ['Only one.', 'And two.'],
+]
+
+
+def make_store():
+    store = DescriptionStore()
+    handles = [store.add(description) for description in DESCRIPTIONS]
+    return store, handles
+
+
+def check(store, handles):
+    assert [store.paragraphs(handle) for handle in handles] == [
+        ['First paragraph.', 'Middle one.', 'Last paragraph.'],
+        ['A single string, with ünïcödé.'],
+        [],
+        ['Only one.', 'And two.'],
+    ]
+    assert store.first_and_last(handles[0]) == ['First paragraph.', 'Last paragraph.']
+    assert store.first_and_last(handles[3]) == ['Only one.', 'And two.']
+
+
+def test_store_round_trips_through_a_memory_map(tmp_path):
+    store, handles = make_store()
+    check(store, handles)
+
+    store.save(tmp_path / 'descriptions.store')
+    check(DescriptionStore.open(tmp_path / 'descriptions.store'), handles)
+    # The temporary file was renamed into place, not left behind
+    assert os.listdir(tmp_path) == ['descriptions.store']
+
+
+def test_spilled_store_is_read_only(tmp_path):
+    store, handles = make_store()
+    store.spill(tmp_path / 'descriptions.store')
+    check(store, handles)
+    with pytest.raises(TypeError):
+        store.add('More text.')
+
+
+def test_spill_reuses_a_store_that_matches(tmp_path):
+    path = tmp_path / 'descriptions.store'
+    make_store()[0].spill(path)
+    written = os.stat(path).st_ino
+
+    # Another worker loading the same catalog maps the existing file
+    store, handles = make_store()
+    store.spill(path)
+    assert os.stat(path).st_ino == written
+    check(store, handles)
+
+
+def test_spill_replaces_a_stale_or_broken_store(tmp_path):
+    path = tmp_path / 'descriptions.store'
+    other = DescriptionStore()
+    other.add('Text of an older catalog.')
+    other.save(path)
+
+    store, handles = make_store()
+    store.spill(path)
+    check(store, handles)
+
+    path.write_bytes(path.read_bytes()[:-10])
+    with pytest.raises(ValueError):
+        DescriptionStore.open(path)
+    store, handles = make_store()
+    store.spill(path)
+    check(DescriptionStore.open(path), handles)
+
+
+def test_book_reads_its_description_from_the_store():
+    store, handles = make_store()
+    book = Book('1', 'Dune', ['Frank Herbert'], 'Adult', ['Science Fiction', 'Classics'], 412, 3, 2,
+                'cover.jpg', store, handles[0])
+    assert book['author'] == 'Frank Herbert'
+    assert book['genres'] == 'Science Fiction, Classics'
+    assert book['description'] == 'First paragraph. Middle one. Last paragraph.'
+    assert book['description_preview'] == 'First paragraph.<br><br>Last paragraph.'
+    assert Book('2', 'Emma', [], 'Adult', [], 0, 1, 1, '', store, handles[2]).formatted_description == NO_DESCRIPTION
+
+    # Only the record's fields answer book['...'], not its internals
+    with pytest.raises(KeyError):
+        book['_descriptions']
+    assert book.get('_description', 'missing') == 'missing'
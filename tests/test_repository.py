@@ -0,0 +1,136 @@
+import json
+import sqlite3
+
+import pytest
+
+from catalog import decode_cursor, sort_key
+from facets import FacetIndex
+from repository import SQLiteRepository
+
+
+def raw_book(number, category='Adult', paragraphs=3):
+    return {'title': f'Book {number % 7} {number}', 'authors': [f'Author {number % 3}'], 'category': category,
+            'genres': ['Fantasy'], 'description': [f'Paragraph {index} of {number}.' for index in range(paragraphs)],
+            'pages': 100 + number, 'copies': 2, 'available': 1, 'url': f'cover-{number}.jpg'}
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / 'catalog.db'), check_interval=0)
+    repository.import_books([raw_book(number, 'Teens' if number % 4 == 0 else 'Adult') for number in range(1, 41)],
+                            batch_size=7)
+    repository.rebuild()
+    yield repository
+    repository.close()
+
+
+def walk(repository, category=None, limit=6):
+    seen, after = [], None
+    while True:
+        books, count, next_cursor = repository.page(category, after=after, limit=limit)
+        books = list(books)
+        assert len(books) == count
+        seen.extend(books)
+        if next_cursor is None:
+            return seen
+        after = decode_cursor(next_cursor)
+
+
+def test_import_numbers_books_in_order(repository):
+    assert len(repository) == 40
+    assert repository.count('teens') == 10
+    assert repository.get('7')['title'] == 'Book 0 7'
+    assert repository.get('41') is None and repository.get('x') is None
+    assert [book['id'] for book in repository.records()] == [str(number) for number in range(1, 41)]
+
+
+def test_pages_walk_the_title_order(repository):
+    everything = sorted(repository.records(), key=sort_key)
+    assert [book['id'] for book in walk(repository)] == [book['id'] for book in everything]
+    assert [book['id'] for book in walk(repository, 'TEENS', limit=3)] == [
+        book['id'] for book in everything if book['category'] == 'Teens']
+
+
+def test_a_list_page_is_one_query(repository):
+    statements = []
+    repository._connection().set_trace_callback(statements.append)
+    books, _, _ = repository.page('adult', limit=10)
+    previews = {book['id']: book['description_preview'] for book in books}
+    assert len(statements) == 1
+    assert previews['14'] == 'Paragraph 0 of 14.<br><br>Paragraph 2 of 14.'
+
+    statements.clear()
+    books = repository.get_many(['3', 'nope', '999', '1', '3'])
+    assert [book and book['id'] for book in books] == ['3', None, None, '1', '3']
+    assert [book['description_preview'] for book in books if book]
+    assert len(statements) == 1
+
+    # The full text is only read by the details page
+    assert books[0]['description_list'] == [f'Paragraph {index} of 3.' for index in range(3)]
+    assert len(statements) == 2
+
+
+def test_a_facet_page_is_one_query(repository):
+    index = FacetIndex(repository.title_order())
+    statements = []
+    repository._connection().set_trace_callback(statements.append)
+    books, count, _ = index.page(index.select({'category': ['teens']}), limit=5)
+    assert [book['description_preview'] for book in books]
+    assert count == 5 and len(statements) == 1
+
+
+def test_writes_from_another_connection_are_noticed(repository, tmp_path):
+    assert not repository.changed()
+
+    other = SQLiteRepository(str(tmp_path / 'catalog.db'))
+    first = other.add(raw_book(100))
+    second = other.add(raw_book(101, paragraphs=1))
+    other.replace('2', raw_book(200))
+    other.close()
+
+    assert (first, second) == ('41', '42')
+    assert repository.changed()
+    assert not repository.changed()
+    assert repository.get('42')['description_preview'] == 'Paragraph 0 of 101.'
+    assert repository.get('2')['title'] == 'Book 4 200'
+
+    # Our own rebuild() accounts for the writes seen so far
+    repository.add(raw_book(102))
+    repository.rebuild()
+    assert not repository.changed()
+
+
+def test_a_rebuild_without_catch_up_leaves_newer_writes_reported(repository, tmp_path):
+    other = SQLiteRepository(str(tmp_path / 'catalog.db'))
+    other.add(raw_book(100))
+    assert repository.changed()
+
+    # Written while the indexes for the first change were being rebuilt
+    other.add(raw_book(101))
+    other.close()
+    version = repository.version
+    repository.rebuild(catch_up=False)
+    assert repository.version == version + 1
+    assert repository.changed()
+
+
+def test_older_databases_get_a_preview_column(tmp_path):
+    path = str(tmp_path / 'old.db')
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT NOT NULL, title_key TEXT NOT NULL,
+            authors TEXT NOT NULL, category TEXT NOT NULL, category_key TEXT NOT NULL, genres TEXT NOT NULL,
+            pages INTEGER, copies INTEGER NOT NULL, available INTEGER NOT NULL, cover_image TEXT NOT NULL);
+        CREATE TABLE descriptions (book_id INTEGER PRIMARY KEY REFERENCES books (id), paragraphs TEXT NOT NULL);
+        PRAGMA user_version = 1;
+    """)
+    connection.execute("INSERT INTO books VALUES (1, 'Emma', 'emma', '[\"Jane Austen\"]', 'Adult', 'adult', "
+                       "'[\"Classics\"]', 474, 1, 1, 'emma.jpg')")
+    connection.execute('INSERT INTO descriptions VALUES (1, ?)', (json.dumps(['One.', 'Two.', 'Three.']),))
+    connection.commit()
+    connection.close()
+
+    repository = SQLiteRepository(path)
+    assert repository.get('1')['description_preview'] == 'One.<br><br>Three.'
+    assert repository._connection().execute('PRAGMA user_version').fetchone()[0] == 2
+    repository.close()
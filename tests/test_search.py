@@ -0,0 +1,97 @@
+import pytest
+
+from search import SearchIndex, tokenize
+
+DOCUMENTS = [
+    (3, {'title': 'The Dragon Reborn', 'author': 'Robert Jordan', 'genres': 'Fantasy',
+         'description': 'The third book of the wheel.'}),
+    (1, {'title': 'Dune', 'author': 'Frank Herbert', 'genres': 'Science Fiction',
+         'description': 'A desert planet and a dragon of a worm.'}),
+    (7, {'title': 'Dragonflight', 'author': 'Anne McCaffrey', 'genres': 'Fantasy, Science Fiction',
+         'description': 'Dragons and their riders defend Pern.'}),
+    (4, {'title': 'Dracula', 'author': 'Bram Stoker', 'genres': 'Horror',
+         'description': 'A count travels to England.'}),
+    (9, {'title': 'Drama Queen', 'author': 'Anon', 'genres': 'Fantasy',
+         'description': 'Dramatic goings on.'}),
+]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex.build(DOCUMENTS)
+
+
+def ids(results):
+    return [doc_id for doc_id, _ in results]
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Dragon's Reborn, 2nd ed.") == ['dragon', 's', 'reborn', '2nd', 'ed']
+    assert tokenize(None) == [] and tokenize('') == []
+
+
+def test_title_matches_outrank_description_matches(index):
+    # Book 1 only mentions a dragon in its description
+    assert ids(index.search('dragon')) == [3, 1]
+    # Among equal matches the shorter book ranks first
+    assert ids(index.search('fantasy')) == [9, 7, 3]
+    assert ids(index.search('fantasy dragon', limit=1)) == [3]
+    assert index.search('') == [] and index.search('unicorn') == []
+
+
+def test_ties_are_broken_by_document_id():
+    index = SearchIndex.build([(doc_id, {'title': 'Same Title'}) for doc_id in (5, 2, 8)])
+    assert ids(index.search('same')) == [2, 5, 8]
+    assert ids(index.search('title', limit=2)) == [2, 5]
+
+
+def test_documents_can_be_replaced_and_removed(index):
+    index.update(4, {'title': 'Dragon Count', 'description': 'Nothing about vampires.'})
+    assert 4 in index and len(index) == 5
+    assert ids(index.search('dragon')) == [4, 3, 1]
+    assert index.search('stoker') == []
+
+    index.remove(4)
+    index.remove(4)
+    assert 4 not in index and len(index) == 4
+    assert ids(index.search('dragon')) == [3, 1]
+    assert 'dracula' not in index.suggest('dra') and 'count' not in index.suggest('co')
+
+
+def test_build_matches_adding_one_at_a_time(index):
+    added = SearchIndex()
+    for doc_id, fields in DOCUMENTS:
+        added.add(doc_id, fields)
+
+    for query in ('dragon', 'fantasy fiction', 'the', 'a count'):
+        assert added.search(query) == index.search(query)
+    for prefix in ('d', 'dr', 'dra', 'drag', 'f', 'the', 'x'):
+        assert added.suggest(prefix) == index.suggest(prefix)
+
+    with pytest.raises(ValueError):
+        SearchIndex.build([(1, {'title': 'One'}), (1, {'title': 'Again'})])
+
+
+def test_suggest_completes_the_last_word_with_the_most_common_terms(index):
+    # 'fantasy' is in three books and 'fiction' in two; ties go alphabetically
+    assert index.suggest('f')[:2] == ['fantasy', 'fiction']
+    assert index.suggest('dra') == ['dragon', 'dracula', 'dragonflight', 'dragons', 'drama', 'dramatic']
+    assert index.suggest('Epic  DRAGONF') == ['epic dragonflight']
+    assert index.suggest('dra', limit=2) == ['dragon', 'dracula']
+    assert index.suggest('zz') == [] and index.suggest('  ') == []
+
+
+def test_suggestions_are_capped_at_the_index_setting():
+    index = SearchIndex.build([(doc_id, {'title': f'word{doc_id}'}) for doc_id in range(20)], suggestions=3)
+    assert len(index.suggest('word')) == 3
+    assert len(index.suggest('word', limit=10)) == 3
+
+    # More books make a term more common, moving it up the list
+    for doc_id in range(20, 25):
+        index.add(doc_id, {'title': 'word17'})
+    assert index.suggest('word')[0] == 'word17'
+
+
+def test_suggest_endpoint(client):
+    data = client.get('/api/suggest?q=The+Katab').get_json()
+    assert data == {'query': 'The Katab', 'suggestions': ['the katabasis']}
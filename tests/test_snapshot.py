@@ -0,0 +1,63 @@
+import pytest
+
+from circulation import CirculationEngine, UnknownBook
+from repository import SnapshotRepository
+from snapshot import Snapshot, SnapshotError, build
+
+
+def raw_book(number):
+    return {'title': f'Book {number}', 'authors': ['Anon', f'Author {number % 2}'], 'category': 'Adult',
+            'genres': ['Fantasy'], 'description': [f'About book {number}.', 'The end.'],
+            'pages': 100 + number, 'copies': 3, 'available': number % 4, 'url': f'cover-{number}.jpg'}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'catalog.snap'
+    build([raw_book(number) for number in range(1, 11)], path)
+    return path
+
+
+def test_records_are_decoded_from_the_mapping(path):
+    snapshot = Snapshot(path, verify=True)
+    assert len(snapshot) == 10
+    book = snapshot.book(2)
+    assert (book['id'], book['title'], book['author'], book['pages']) == ('3', 'Book 3', 'Anon, Author 1', 103)
+    assert book['description_preview'] == 'About book 3.<br><br>The end.'
+    assert snapshot.copy_count(2) == (3, 3)
+
+
+def test_corruption_is_caught(path):
+    data = bytearray(path.read_bytes())
+    data[-3] ^= 0xFF
+    path.write_bytes(bytes(data))
+    Snapshot(path)
+    with pytest.raises(SnapshotError):
+        Snapshot(path, verify=True)
+
+    path.write_bytes(bytes(data[:-1]))
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
+
+
+def test_circulation_tracks_snapshot_books_on_first_use(path, tmp_path):
+    repository = SnapshotRepository(Snapshot(path))
+    assert repository.stored_counts('4') == (3, 0)
+    assert repository.stored_counts('11') is None and repository.stored_counts('x') is None
+
+    engine = CirculationEngine(tmp_path / 'circulation.log', sync=False)
+    engine.seed_lazily(repository.stored_counts)
+    engine.open()
+    assert engine.available('2') == 2
+    engine.checkout('2')
+    with pytest.raises(UnknownBook):
+        engine.checkout('11')
+    engine.close()
+
+    # Replaying the log only touches the books it mentions
+    replayed = CirculationEngine(tmp_path / 'circulation.log', sync=False)
+    replayed.seed_lazily(repository.stored_counts)
+    replayed.open()
+    assert replayed.available('2') == 1
+    assert list(replayed._books) == ['2']
+    replayed.close()